@@ -0,0 +1,216 @@
+"""
+End-to-end throughput benchmark of the main.py pipeline against the local Sheets API stand-in.
+For every stage it reports the rows per second, the API calls per row and the peak memory.
+
+    python benchmark.py 1000 10000 100000 --latency 0.05 --batch-size 100
+
+It also measures the cold start of the modules and of the light CLI commands.
+"""
+from time import perf_counter
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+
+import main
+from fake_sheets import FakeSheetsService, generate_give_values, generate_need_values
+
+need_spreadsheet_id = "need"
+give_spreadsheet_id = "give"
+# The only tab of the fake give houses spreadsheet, so its gsheet id is 0
+give_tab = "give"
+
+
+def reset_run_state() -> None:
+    """
+    This function reset the module-level state of main, so every benchmark run starts clean
+    :return:
+    """
+    main.people_that_have_filter.clear()
+    main.created_filter_views.clear()
+    main.filter_views_index.clear()
+    main.run_metrics = main.RunMetrics()
+    main.snapshot_store = None
+    main.checkpoint_journal = None
+
+
+def measure_stage(name, rows, service, function, *args):
+    """
+    This function run one stage and return its result and its measurements
+    :param name:
+    :param rows: the number of rows that the stage gets
+    :param service: the fake service, to count the API calls of the stage
+    :param function:
+    :param args:
+    :return:
+    """
+    calls_before = sum(service.calls.values())
+    tracemalloc.start()
+    start = perf_counter()
+    # The pipeline prints its errors and a progress bar, the API responses are only logged at DEBUG
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(
+        devnull
+    ), contextlib.redirect_stderr(devnull):
+        result = function(*args)
+    seconds = perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    api_calls = sum(service.calls.values()) - calls_before
+    return result, {
+        "stage": name,
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows per second": round(rows / seconds) if seconds else None,
+        "api calls": api_calls,
+        "api calls per row": round(api_calls / rows, 4) if rows else None,
+        "peak memory MB": round(peak_memory / 2**20, 2),
+    }
+
+
+# The commands whose cold start is measured, each in a new interpreter
+startup_commands = {
+    "python": ["-c", "pass"],
+    "import main": ["-c", "import main"],
+    "import matching": ["-c", "import matching"],
+    "cli.py report": ["cli.py", "report"],
+}
+
+
+def measure_startup(repeat=3) -> list:
+    """
+    This function measure the cold start of every startup command, the best of repeat runs
+    :param repeat:
+    :return:
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    startup = []
+    for name, command in startup_commands.items():
+        seconds = []
+        for _ in range(repeat):
+            start = perf_counter()
+            subprocess.run(
+                [sys.executable, *command], cwd=directory, capture_output=True, check=True
+            )
+            seconds.append(perf_counter() - start)
+        startup.append({"command": name, "seconds": round(min(seconds), 4)})
+    return startup
+
+
+def run_benchmark(rows, latency=0.0, quota_error_rate=0.0, batch_size=100) -> list:
+    """
+    This function run the pipeline stages on synthetic sheets of the given size
+    :param rows: the number of rows in the need sheet and in the give sheet
+    :param latency: seconds that every fake API request takes
+    :param quota_error_rate: the probability that a fake API request fails with 429
+    :param batch_size:
+    :return: the measurements of every stage
+    """
+    service = FakeSheetsService(
+        {
+            need_spreadsheet_id: {main.need_sheet_range: generate_need_values(rows)},
+            give_spreadsheet_id: {give_tab: generate_give_values(rows)},
+        },
+        latency=latency,
+        quota_error_rate=quota_error_rate,
+    )
+    main.sheets_service = service
+    # The benchmark measures the pipeline, not the pacing of the real quota
+    main.rate_limiter = main.RateLimiter(requests_per_minute=60 * 10**6, burst=10**6)
+    reset_run_state()
+
+    stages = []
+    # The need sheet is read like main() reads it, only the used columns
+    need_house_df, stage = measure_stage(
+        "get_df_columns",
+        rows,
+        service,
+        main.get_df_from_google_sheet,
+        "need_df",
+        "",
+        need_spreadsheet_id,
+        True,
+    )
+    stages.append(stage)
+    need_house_df, stage = measure_stage(
+        "clean_need_df", len(need_house_df), service, main.clean_need_df, need_house_df
+    )
+    stages.append(stage)
+    need_house_df, stage = measure_stage(
+        "dedup_need_df", len(need_house_df), service, main.dedup_need_df, need_house_df
+    )
+    stages.append(stage)
+    give_range, _ = main.init_spreadsheet(give_spreadsheet_id, 0)
+    need_range, _ = main.init_spreadsheet(need_spreadsheet_id, 0)
+    for name, function, my_range, spreadsheet_id in [
+        ("give_filters", main.give_filters, give_range, give_spreadsheet_id),
+        ("treatment_filters", main.treatment_filters, need_range, need_spreadsheet_id),
+        (
+            "request_type_filters",
+            main.request_type_filters,
+            need_range,
+            need_spreadsheet_id,
+        ),
+    ]:
+        _, stage = measure_stage(
+            name,
+            len(need_house_df),
+            service,
+            function,
+            need_house_df,
+            my_range,
+            service,
+            spreadsheet_id,
+            batch_size,
+        )
+        stages.append(stage)
+    return stages
+
+
+def print_stages(rows, stages) -> None:
+    """
+    This function print the measurements of one benchmark run as a table
+    :param rows:
+    :param stages:
+    :return:
+    """
+    print(f"\n{rows} rows")
+    print(
+        f"{'stage':<22}{'rows':>8}{'seconds':>10}{'rows/sec':>12}{'calls/row':>11}{'peak MB':>10}"
+    )
+    for stage in stages:
+        print(
+            f"{stage['stage']:<22}{stage['rows']:>8}{stage['seconds']:>10}"
+            f"{stage['rows per second'] or 0:>12}{stage['api calls per row'] or 0:>11}"
+            f"{stage['peak memory MB']:>10}"
+        )
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("rows", nargs="*", type=int, default=[1000, 10000])
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--quota-error-rate", type=float, default=0.0)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {"startup": measure_startup()}
+    print(f"{'command':<22}{'seconds':>10}")
+    for command in results["startup"]:
+        print(f"{command['command']:<22}{command['seconds']:>10}")
+    for rows in args.rows:
+        stages = run_benchmark(
+            rows, args.latency, args.quota_error_rate, args.batch_size
+        )
+        print_stages(rows, stages)
+        results[rows] = stages
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
@@ -0,0 +1,201 @@
+"""
+Command line entry point of HouseFinder. Every subcommand imports only the modules it needs,
+so the light ones, like report, start without loading pandas or the Google API client.
+
+    python cli.py fetch                  read both sheets from the API into the local snapshots
+    python cli.py clean                  write the cleaned need houses to a CSV file
+    python cli.py plan plan.jsonl        write the filter view operations, without sending them
+    python cli.py apply plan.jsonl       send the operations of a plan
+    python cli.py report                 print the last run report and the rows with errors
+    python cli.py match [--assign]       write the host candidates, or the assignments, of the families
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+
+def open_snapshots(args, ttl=None):
+    """
+    This function import main and point its sheet reads at the local snapshots
+    :param args:
+    :param ttl: seconds a snapshot is used, None uses it whatever its age and 0 always fetches the sheet
+    :return: the main module
+    """
+    import main
+
+    main.snapshot_store = main.SnapshotStore(args.snapshot_dir, ttl, args.offline)
+    return main
+
+
+def get_clean_need_df(main, args):
+    """
+    This function return the cleaned, and deduplicated, need houses
+    :param main:
+    :param args:
+    :return:
+    """
+    need_house_df = main.get_df_from_google_sheet(
+        "need_df", need_spreadsheet_id=args.need_spreadsheet_id, only_used_columns=True
+    )
+    need_house_df = main.clean_need_df(need_house_df)
+    if args.dedup != "none":
+        need_house_df = main.dedup_need_df(need_house_df, args.dedup)
+    return need_house_df
+
+
+def fetch(args) -> None:
+    main = open_snapshots(args, ttl=0)
+    need_house_df = main.get_df_from_google_sheet(
+        "need_df", need_spreadsheet_id=args.need_spreadsheet_id, only_used_columns=True
+    )
+    give_house_df = main.get_df_from_google_sheet(
+        "give_df",
+        give_spreadsheet_id=args.give_spreadsheet_id,
+        give_gsheet_id=args.give_gsheet_id,
+        give_header_row_number=args.give_header_row,
+    )
+    print(f"{len(need_house_df)} need rows and {len(give_house_df)} give rows fetched")
+
+
+def clean(args) -> None:
+    main = open_snapshots(args, args.snapshot_ttl)
+    need_house_df = get_clean_need_df(main, args)
+    need_house_df.to_csv(args.output, encoding="utf-8-sig")
+    print(f"{len(need_house_df)} need rows written to {args.output}")
+
+
+def plan(args) -> None:
+    main = open_snapshots(args, args.snapshot_ttl)
+    operations = main.create_plan(
+        get_clean_need_df(main, args),
+        args.give_spreadsheet_id,
+        args.give_gsheet_id,
+        args.need_spreadsheet_id,
+        args.need_gsheet_id,
+    )
+    main.write_plan(operations, args.plan_path)
+    print(f"{len(operations)} operations written to {args.plan_path}")
+
+
+def apply(args) -> None:
+    import main
+
+    main.checkpoint_journal = main.CheckpointJournal(args.checkpoint_path, args.resume)
+    main.apply_plan(main.read_plan(args.plan_path), args.batch_size)
+    main.checkpoint_journal.close()
+    main.write_run_report(args.report_path)
+
+
+def report(args) -> None:
+    if not os.path.exists(args.report_path):
+        print(f"No run report in {args.report_path}")
+        return
+    with open(args.report_path, encoding="utf-8") as f:
+        run_report = json.load(f)
+    for stage, values in run_report["stages"].items():
+        print(f"{stage:<22}{values['seconds']:>10} seconds")
+    api_calls = sum(values["calls"] for values in run_report["api"].values())
+    print(f"{api_calls} API calls, retries: {run_report['retries']}, errors: {run_report['errors']}")
+    if os.path.exists(args.errors_path):
+        with open(args.errors_path, encoding="utf-8") as f:
+            rows_with_errors = f.read().splitlines()
+        print(f"{len(rows_with_errors)} rows with errors")
+        for row in rows_with_errors:
+            print(f"  {row}")
+
+
+def match(args) -> None:
+    open_snapshots(args, args.snapshot_ttl)
+    import matching
+
+    if args.assign:
+        matching.create_assignment_files(
+            args.need_spreadsheet_id,
+            args.give_spreadsheet_id,
+            "assignments.csv",
+            "unmatched.csv",
+            args.give_gsheet_id,
+            args.give_header_row,
+        )
+    else:
+        matching.create_matches_file(
+            args.need_spreadsheet_id,
+            args.give_spreadsheet_id,
+            "matches.csv",
+            args.max_candidates,
+            args.give_gsheet_id,
+            args.give_header_row,
+        )
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--need-spreadsheet-id", default="")
+    parser.add_argument("--need-gsheet-id", type=int, default=0)
+    parser.add_argument("--give-spreadsheet-id", default="")
+    parser.add_argument("--give-gsheet-id", type=int, default=0)
+    parser.add_argument(
+        "--give-header-row", type=int, default=2, help="the row of the headers in the give houses tab"
+    )
+    parser.add_argument("--snapshot-dir", default="snapshots")
+    parser.add_argument(
+        "--snapshot-ttl",
+        type=float,
+        default=None,
+        help="seconds a snapshot is used before the sheet is fetched again, "
+        "by default a snapshot is used whatever its age",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="fail instead of reading a sheet that has no snapshot from the API",
+    )
+    parser.add_argument(
+        "--dedup",
+        choices=["collapse", "flag", "none"],
+        default="collapse",
+        help="what to do with the repeated form submissions of a family, none keeps them",
+    )
+    parser.add_argument("--report-path", default="run_report.json")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("fetch", help="read both sheets into the snapshots").set_defaults(
+        function=fetch
+    )
+
+    clean_parser = subparsers.add_parser("clean", help="write the cleaned need houses")
+    clean_parser.add_argument("--output", default="need_houses_clean.csv")
+    clean_parser.set_defaults(function=clean)
+
+    plan_parser = subparsers.add_parser("plan", help="write the filter view operations")
+    plan_parser.add_argument("plan_path")
+    plan_parser.set_defaults(function=plan)
+
+    apply_parser = subparsers.add_parser("apply", help="send the operations of a plan")
+    apply_parser.add_argument("plan_path")
+    apply_parser.add_argument("--batch-size", type=int, default=100)
+    apply_parser.add_argument("--checkpoint-path", default="checkpoint_journal.jsonl")
+    apply_parser.add_argument("--resume", action="store_true")
+    apply_parser.set_defaults(function=apply)
+
+    report_parser = subparsers.add_parser("report", help="print the last run report")
+    report_parser.add_argument("--errors-path", default="people_that_have_errors.txt")
+    report_parser.set_defaults(function=report)
+
+    match_parser = subparsers.add_parser("match", help="match the families to the hosts")
+    match_parser.add_argument("--assign", action="store_true")
+    match_parser.add_argument("--max-candidates", type=int, default=20)
+    match_parser.set_defaults(function=match)
+    return parser
+
+
+def main_cli():
+    args = get_parser().parse_args()
+    logging.basicConfig(level=logging.INFO)
+    args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
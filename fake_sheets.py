@@ -0,0 +1,318 @@
+"""
+Local stand-in for the part of the Google Sheets API that main.py uses, and generators of
+synthetic need and give sheets. Used by benchmark.py to measure the pipeline without the live API.
+"""
+from collections import Counter
+from time import sleep
+import json
+import random
+import re
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+# The headers of the need houses sheet, in the order of the real sheet columns
+need_headers = [
+    "חותמת זמן",
+    "כתובת אימייל",
+    "שם מלא",
+    "טלפון  (אנא ציינו רק ספרות, ללא מקף ורווח)",
+    "מאיזה יישוב אתם מגיעים ?  ",
+    "מה מספר אורחים שצריכים מקום?",
+    "הערות/בקשות",
+    'האם יש בע"ח שבאים איתכם ?',
+    "האם חובה ממד  ?(שימו לב-  בית עם מקלט במקום ממד מזרז משמעותית זמני טיפול) ",
+    "האם זקוקים לעזרה בהסעות?",
+    'האם שומרי כשרות?',
+    "האם זקוקים לבית מונגש ?",
+    'פירוט על בע"ח',
+    "פירוט לגבי בית מונגש",
+    "פירוט לגבי כשרות",
+    "הערות",
+    "שונות",
+    "בטיפול של מי?",
+    "אצל מי מתארחים",
+    "",
+    "מצב הבקשה",
+]
+need_statuses = ["", "", "", "בטיפול", "איפוס", "ממתינים לבית ריק", "שובץ", "לא רלוונטי"]
+give_statuses = ["", "", "", "איפוס", "שובץ", "לא רלוונטי", "בטיפול"]
+treatment_people = ["", "דנה", "יוסי", "מיכל", "אבי", "רונית"]
+answers = ["כן", "לא", ""]
+
+
+def generate_need_values(rows, seed=0) -> list:
+    """
+    This function generate the values of a synthetic need houses sheet, as values().get returns them:
+    a title row, the header row and then a row per family, without the empty cells at the end of the row
+    :param rows:
+    :param seed:
+    :return:
+    """
+    rng = random.Random(seed)
+    values = [["טופס צריכים אירוח"], list(need_headers)]
+    for i in range(rows):
+        row = [
+            f"{rng.randint(1, 28)}/10/2023 {rng.randint(0, 23)}:{rng.randint(0, 59):02d}:00",
+            f"family{i}@example.com",
+            f"משפחה {i}",
+            f"05{rng.randint(0, 99999999):08d}",
+            "שדרות",
+            rng.choice(["1", "2", "3", "4", "5", "6", "זוג", "8"]),
+            "",
+            rng.choice(answers),
+            rng.choice(answers),
+            rng.choice(answers),
+            rng.choice(answers),
+            rng.choice(answers),
+            "",
+            "",
+            "",
+            "",
+            "",
+            rng.choice(treatment_people),
+            "",
+            "",
+            rng.choice(need_statuses),
+        ]
+        while row and row[-1] == "":
+            row.pop()
+        values.append(row)
+    return values
+
+
+def generate_give_values(rows, seed=0) -> list:
+    """
+    This function generate the values of a synthetic give houses sheet. The columns that the filter
+    views filter on are 4 (number of guests), 11 and 12 (kosher), 15 (pets), 16 (mamad) and 22 (status)
+    :param rows:
+    :param seed:
+    :return:
+    """
+    rng = random.Random(seed)
+    values = [["טופס נותנים אירוח"], [f"עמודה {column}" for column in range(23)]]
+    for i in range(rows):
+        row = [""] * 23
+        row[0] = f"{rng.randint(1, 28)}/10/2023"
+        row[1] = f"מארח {i}"
+        row[4] = str(rng.randint(1, 12))
+        row[11] = rng.choice(answers)
+        row[12] = rng.choice(["לא", ""])
+        row[15] = rng.choice(answers)
+        row[16] = rng.choice(answers)
+        row[22] = rng.choice(give_statuses)
+        while row and row[-1] == "":
+            row.pop()
+        values.append(row)
+    return values
+
+
+def make_http_error(status, message) -> HttpError:
+    """
+    This function create an HttpError like the ones of the Sheets API
+    :param status:
+    :param message:
+    :return:
+    """
+    resp = httplib2.Response({"status": status})
+    resp.reason = message
+    content = json.dumps({"error": {"code": status, "message": message}})
+    return HttpError(resp, content.encode("utf-8"))
+
+
+def column_index(letters) -> int:
+    """
+    This function convert A1 column letters to a 0-based column index (A -> 0, AA -> 26)
+    :param letters:
+    :return:
+    """
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+class FakeRequest:
+    """
+    A request of the fake service, executed only when execute() is called like googleapiclient requests
+    """
+
+    def __init__(self, service, method, function):
+        self.service = service
+        self.method = method
+        self.function = function
+
+    def execute(self, num_retries=0):
+        return self.service.execute(self.method, self.function)
+
+
+class FakeSheetsService:
+    """
+    In-memory stand-in of the Sheets API service. It serves values().get, values().batchGet,
+    spreadsheets().get and batchUpdate with addFilterView, deleteFilterView and updateFilterView,
+    and can inject latency and 429 quota errors.
+    A second filter view with the same title fails with the "שם אחר" error, like the Hebrew UI.
+    """
+
+    def __init__(self, sheets, latency=0.0, quota_error_rate=0.0, seed=0):
+        """
+        :param sheets: spreadsheet_id -> {tab: values}, the gsheet id of a tab is its position
+        :param latency: seconds that every request takes
+        :param quota_error_rate: the probability that a request fails with 429
+        :param seed:
+        """
+        self.sheets = sheets
+        self.latency = latency
+        self.quota_error_rate = quota_error_rate
+        self.random = random.Random(seed)
+        self.filter_views = {spreadsheet_id: {} for spreadsheet_id in sheets}
+        self.next_filter_view_id = 1
+        self.calls = Counter()
+        self.cells = 0
+
+    def execute(self, method, function):
+        self.calls[method] += 1
+        if self.latency:
+            sleep(self.latency)
+        if self.random.random() < self.quota_error_rate:
+            raise make_http_error(429, "Quota exceeded")
+        return function()
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return FakeValues(self)
+
+    def get(self, spreadsheetId, fields=None, **kwargs):
+        def get_properties():
+            # The gsheet id of every tab is its position in the spreadsheet
+            return {
+                "sheets": [
+                    {"properties": {"sheetId": sheet_id, "title": title}}
+                    for sheet_id, title in enumerate(self.sheets[spreadsheetId])
+                ]
+            }
+
+        def get_filter_views():
+            # Only the fields of the filter views that the fields mask asks for are returned
+            mask = re.search(r"filterViews\(([^)]*)\)", fields or "")
+            filter_view_fields = (
+                mask.group(1).split(",") if mask else ["title", "filterViewId"]
+            )
+            filter_views = [
+                {
+                    field: filter_view[field]
+                    for field in filter_view_fields
+                    if field in filter_view
+                }
+                for filter_view in self.filter_views[spreadsheetId].values()
+            ]
+            return {"sheets": [{"filterViews": filter_views}]}
+
+        if "properties" in (fields or ""):
+            return FakeRequest(self, "get", get_properties)
+        return FakeRequest(self, "get", get_filter_views)
+
+    def batchUpdate(self, spreadsheetId, body):
+        return FakeRequest(
+            self, "batchUpdate", lambda: self.apply_requests(spreadsheetId, body["requests"])
+        )
+
+    def apply_requests(self, spreadsheet_id, requests) -> dict:
+        """
+        Apply the requests of one batchUpdate. Like the real API, the batch is atomic
+        """
+        filter_views = dict(self.filter_views[spreadsheet_id])
+        ids = {
+            filter_view["filterViewId"]: title for title, filter_view in filter_views.items()
+        }
+        replies = []
+        for request in requests:
+            if "addFilterView" in request:
+                filter_view = dict(request["addFilterView"]["filter"])
+                if filter_view["title"] in filter_views:
+                    raise make_http_error(
+                        400, "כבר קיימת תצוגת סינון בשם הזה. יש לבחור שם אחר."
+                    )
+                filter_view["filterViewId"] = self.next_filter_view_id
+                self.next_filter_view_id += 1
+                filter_views[filter_view["title"]] = filter_view
+                ids[filter_view["filterViewId"]] = filter_view["title"]
+                replies.append({"addFilterView": {"filter": filter_view}})
+            elif "deleteFilterView" in request:
+                filter_view_id = request["deleteFilterView"]["filterId"]
+                if filter_view_id not in ids:
+                    raise make_http_error(400, f"No filter view with id: {filter_view_id}")
+                del filter_views[ids.pop(filter_view_id)]
+                replies.append({})
+            elif "updateFilterView" in request:
+                filter_view = request["updateFilterView"]["filter"]
+                if filter_view["filterViewId"] not in ids:
+                    raise make_http_error(
+                        400, f"No filter view with id: {filter_view['filterViewId']}"
+                    )
+                title = ids.pop(filter_view["filterViewId"])
+                updated = dict(filter_views.pop(title), **filter_view)
+                filter_views[updated["title"]] = updated
+                ids[updated["filterViewId"]] = updated["title"]
+                replies.append({})
+            else:
+                raise make_http_error(400, f"Unsupported request: {list(request)}")
+        self.filter_views[spreadsheet_id] = filter_views
+        return {"spreadsheetId": spreadsheet_id, "replies": replies}
+
+
+class FakeValues:
+    """
+    The values() collection of the fake service
+    """
+
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, spreadsheetId, range, fields=None, **kwargs):
+        return FakeRequest(
+            self.service, "values.get", lambda: {"values": self.read(spreadsheetId, range)}
+        )
+
+    def batchGet(self, spreadsheetId, ranges, majorDimension="ROWS", fields=None):
+        def batch_get():
+            value_ranges = []
+            for a1_range in ranges:
+                values = self.read(spreadsheetId, a1_range, majorDimension)
+                value_ranges.append({"values": values} if values else {})
+            return {"valueRanges": value_ranges}
+
+        return FakeRequest(self.service, "values.batchGet", batch_get)
+
+    def read(self, spreadsheet_id, a1_range, major_dimension="ROWS") -> list:
+        """
+        Read a tab, rows like '2:2' or columns like 'C2:C' and 'C2:C100', without the empty cells
+        at the end of every row (or column)
+        """
+        tab, _, cells = a1_range.partition("!")
+        values = self.service.sheets[spreadsheet_id][tab.strip("'")]
+        if cells:
+            match = re.fullmatch(r"([A-Z]*)(\d+):([A-Z]*)(\d*)", cells)
+            first_column, first_row, last_column, last_row = match.groups()
+            rows = values[int(first_row) - 1 : int(last_row) if last_row else None]
+            if first_column:
+                first_column, last_column = column_index(first_column), column_index(last_column)
+                rows = [row[first_column : last_column + 1] for row in rows]
+        else:
+            rows = values
+        if major_dimension == "COLUMNS":
+            width = max((len(row) for row in rows), default=0)
+            rows = [
+                [row[column] if column < len(row) else "" for row in rows]
+                for column in range(width)
+            ]
+        rows = [list(row) for row in rows]
+        for row in rows:
+            while row and row[-1] == "":
+                row.pop()
+        while rows and not rows[-1]:
+            rows.pop()
+        self.service.cells += sum(len(row) for row in rows)
+        return rows
@@ -1,17 +1,47 @@
-from __future__ import print_function
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from __future__ import annotations, print_function
 from googleapiclient.errors import HttpError
-from typing import List, Any
-from tqdm import tqdm
-from time import sleep
+from typing import TYPE_CHECKING, List, Any
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from enum import Enum, IntEnum
+from time import sleep, monotonic, time
 import pandas as pd
 import os.path
-import google
+import argparse
+import bisect
+import difflib
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import numpy as np
+import random
+import re
+import sqlite3
+import threading
+
+# The Google auth and discovery stack and tqdm are imported only when the API is used, see get_service
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.http import HttpRequest
+    import google_auth_httplib2
+
+logger = logging.getLogger(__name__)
 
 people_that_have_filter = []
+# title -> filterViewId of the filter views created in this run
+created_filter_views = {}
+# spreadsheet_id -> {title: filterViewId} of the filter views that exist in the spreadsheet
+filter_views_index = {}
+# The CheckpointJournal of the run, or None when the run is not checkpointed
+checkpoint_journal = None
+# local snapshots of the fetched sheets, set by main; None always reads the sheets from the API
+snapshot_store = None
+# prepended to the names of the txt report files, so every shard process writes its own
+report_files_prefix = ""
+# The titles of the give houses filter views that create_filter_view_request creates: <row>_<full name>
+family_filter_view_title = re.compile(r"^\d+_")
 
 date_column = "0"
 number_of_guests_column = "4"
@@ -19,41 +49,457 @@ kosher_column = "11"
 pets_column = "15"
 mamad_column = "8"
 request_status = "20"
+# Give houses with these statuses are hidden from the filter views
+give_hidden_statuses = ["שובץ", "לא רלוונטי", "בטיפול"]
+
+# The Hebrew headers of the need houses columns that the script uses and their English names
+need_columns_rename = {
+    "חותמת זמן": "timestamp",
+    # "כתובת אימייל": "email address",
+    "שם מלא": "full name",
+    "טלפון  (אנא ציינו רק ספרות, ללא מקף ורווח)": "phone number",
+    # "מאיזה יישוב אתם מגיעים ?  ": "origin city",
+    "מה מספר אורחים שצריכים מקום?": "number of guests",
+    # "הערות/בקשות": "notes/requests",
+    "האם יש בעח שבאים איתכם ?": "pets",
+    # "האם זקוקים לעזרה בהסעות?": "transportation assistance",
+    "האם שומרי כשרות?": "kosher",
+    # "האם זקוקים לבית מונגש ?": "accessible",
+    # "פירוט על בעח": "pets details",
+    # "פירוט לגבי בית מונגש": "accessible details",
+    # "פירוט לגבי כשרות": "kosher details",
+    # "הערות": "notes",
+    "בטיפול של מי?": "treatment",
+    # "אצל מי מתארחים": "who is hosting",
+    # "שונות": "other",
+    "מצב הבקשה": "request status",
+    # "Unnamed: 19": "unknown",
+    "האם חובה ממד  ?(שימו לב-  בית עם מקלט במקום ממד מזרז משמעותית זמני טיפול) ": "mamad",
+}
+
+# A blank status is a new request and a blank number of guests is dropped, like the None cells of get_df
+need_blank_as_missing = ["מצב הבקשה", "מה מספר אורחים שצריכים מקום?"]
+
+# The tab of the need houses spreadsheet, the give houses tab is found by its gsheet id
+need_sheet_range = "גיליון צריכים אירוח"
+# The form timestamp column of the need houses sheet, polled by the watch mode to detect new rows
+need_timestamp_column = 0
+
+# Sheets API per-user quota, shared by all the passes that run at the same time.
+# The send rate starts at sheets_requests_per_minute and adapts, up to the per-project quota
+sheets_requests_per_minute = 60
+sheets_max_requests_per_minute = 300
+# HTTP statuses of the Sheets API that are worth retrying
+retryable_statuses = (429, 503)
+max_retries = 5
+
+
+# If modifying these scopes, delete the file token.json.
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+# The credentials and the Sheets service are created once and shared by the whole run
+sheets_credentials = None
+sheets_service = None
+service_lock = threading.RLock()
+# Every thread keeps its own keep-alive connection, because httplib2 is not thread safe
+thread_local_http = threading.local()
+
+
+class RateLimiter:
+    """
+    Token bucket that paces the Sheets API calls of all the threads to the per-user quota
+    """
+
+    def __init__(self, requests_per_minute, burst=1):
+        self.rate = requests_per_minute / 60
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Wait until a token is available and take it
+        """
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+    def on_response(self, seconds) -> None:
+        """
+        Called after every successful API call with its latency, the fixed rate ignores it
+        """
+
+    def on_throttle(self) -> None:
+        """
+        Called after every 429 or 503 response, the fixed rate ignores it
+        """
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    Token bucket whose rate follows the real quota with AIMD: it grows by a few requests per minute
+    with every successful answer, and is halved on a 429 or a 503
+    """
+
+    def __init__(
+        self,
+        requests_per_minute,
+        burst=1,
+        min_requests_per_minute=6,
+        max_requests_per_minute=sheets_max_requests_per_minute,
+        increase_per_minute=6,
+        decrease_factor=0.5,
+    ):
+        """
+        :param requests_per_minute: the starting rate
+        :param burst:
+        :param min_requests_per_minute:
+        :param max_requests_per_minute:
+        :param increase_per_minute: the requests per minute added after a minute of successful answers
+        :param decrease_factor: the rate is multiplied by it on a 429 or a 503
+        """
+        super().__init__(requests_per_minute, burst)
+        self.min_rate = min_requests_per_minute / 60
+        self.max_rate = max_requests_per_minute / 60
+        self.increase = increase_per_minute / 60
+        self.decrease_factor = decrease_factor
+        self.decreased = float("-inf")
+
+    def on_response(self, seconds) -> None:
+        # The latency is not a congestion signal: a batchUpdate of many requests is slow even under the quota
+        with self.lock:
+            # One success adds increase / rate, so the rate grows by increase every minute
+            self.rate = min(self.max_rate, self.rate + self.increase / (self.rate * 60))
+
+    def on_throttle(self) -> None:
+        with self.lock:
+            # The requests that were in flight when the quota ran out fail together, decrease once for them
+            if monotonic() - self.decreased < 1 / self.rate:
+                return
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self.decreased = monotonic()
+        logger.info(f"Sheets API send rate lowered to {self.rate * 60:.0f} requests per minute")
+
+
+rate_limiter = AdaptiveRateLimiter(sheets_requests_per_minute)
+
+
+class RunMetrics:
+    """
+    Wall time of every stage and latency, bytes, retries and errors of the Sheets API calls of one run
+    """
+
+    # Upper bounds in seconds of the API latency histogram buckets
+    latency_buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf")]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stage_seconds = defaultdict(float)
+        self.stage_calls = Counter()
+        self.api_calls = Counter()
+        self.api_seconds = defaultdict(float)
+        self.api_latency_histograms = defaultdict(
+            lambda: [0] * len(self.latency_buckets)
+        )
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = Counter()
+        self.errors = Counter()
+
+    def record_stage(self, stage, seconds) -> None:
+        with self.lock:
+            self.stage_seconds[stage] += seconds
+            self.stage_calls[stage] += 1
+
+    def record_api_call(self, method, seconds, bytes_sent, bytes_received) -> None:
+        with self.lock:
+            self.api_calls[method] += 1
+            self.api_seconds[method] += seconds
+            histogram = self.api_latency_histograms[method]
+            for i, bucket in enumerate(self.latency_buckets):
+                if seconds <= bucket:
+                    histogram[i] += 1
+                    break
+            self.bytes_sent += bytes_sent
+            self.bytes_received += bytes_received
+
+    def record_retry(self, status) -> None:
+        with self.lock:
+            self.retries[str(status)] += 1
+
+    def record_error(self, category) -> None:
+        with self.lock:
+            self.errors[category] += 1
+
+    def to_dict(self) -> dict:
+        """
+        Return the metrics as a JSON serializable dict
+        """
+        with self.lock:
+            return {
+                "stages": {
+                    stage: {
+                        "seconds": round(seconds, 4),
+                        "calls": self.stage_calls[stage],
+                    }
+                    for stage, seconds in self.stage_seconds.items()
+                },
+                "api": {
+                    method: {
+                        "calls": calls,
+                        "seconds": round(self.api_seconds[method], 4),
+                        "latency histogram": dict(
+                            zip(
+                                [str(bucket) for bucket in self.latency_buckets],
+                                self.api_latency_histograms[method],
+                            )
+                        ),
+                    }
+                    for method, calls in self.api_calls.items()
+                },
+                "bytes sent": self.bytes_sent,
+                "bytes received": self.bytes_received,
+                "retries": dict(self.retries),
+                "errors": dict(self.errors),
+            }
 
+    def merge(self, report) -> None:
+        """
+        Add the metrics of another run, in the to_dict format, for example of a shard process
+        """
+        with self.lock:
+            for stage, values in report["stages"].items():
+                self.stage_seconds[stage] += values["seconds"]
+                self.stage_calls[stage] += values["calls"]
+            for method, values in report["api"].items():
+                self.api_calls[method] += values["calls"]
+                self.api_seconds[method] += values["seconds"]
+                histogram = self.api_latency_histograms[method]
+                for i, count in enumerate(values["latency histogram"].values()):
+                    histogram[i] += count
+            self.bytes_sent += report["bytes sent"]
+            self.bytes_received += report["bytes received"]
+            self.retries.update(report["retries"])
+            self.errors.update(report["errors"])
+
+    def to_prometheus(self) -> str:
+        """
+        Return the metrics in the Prometheus text exposition format
+        """
+        report = self.to_dict()
+        lines = [
+            "# TYPE housefinder_stage_seconds counter",
+            *[
+                f'housefinder_stage_seconds{{stage="{stage}"}} {values["seconds"]}'
+                for stage, values in report["stages"].items()
+            ],
+            "# TYPE housefinder_api_latency_seconds histogram",
+        ]
+        for method, values in report["api"].items():
+            cumulative = 0
+            for bucket, count in values["latency histogram"].items():
+                cumulative += count
+                bucket = "+Inf" if bucket == "inf" else bucket
+                lines.append(
+                    f'housefinder_api_latency_seconds_bucket{{method="{method}",le="{bucket}"}} {cumulative}'
+                )
+            lines.append(
+                f'housefinder_api_latency_seconds_sum{{method="{method}"}} {values["seconds"]}'
+            )
+            lines.append(
+                f'housefinder_api_latency_seconds_count{{method="{method}"}} {values["calls"]}'
+            )
+        lines.append("# TYPE housefinder_api_bytes_total counter")
+        lines.append(f'housefinder_api_bytes_total{{direction="sent"}} {report["bytes sent"]}')
+        lines.append(
+            f'housefinder_api_bytes_total{{direction="received"}} {report["bytes received"]}'
+        )
+        lines.append("# TYPE housefinder_api_retries_total counter")
+        for status, count in report["retries"].items():
+            lines.append(f'housefinder_api_retries_total{{status="{status}"}} {count}')
+        lines.append("# TYPE housefinder_api_errors_total counter")
+        for category, count in report["errors"].items():
+            lines.append(f'housefinder_api_errors_total{{category="{category}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+run_metrics = RunMetrics()
 
-def get_df(spreadsheet_id) -> pd.DataFrame:
+
+def timed_stage(stage):
     """
-    Get the Google sheet and convert it to a dataframe
+    Decorator that add the wall time of the function to the stage in run_metrics
     """
-    # If modifying these scopes, delete the file token.json.
-    SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = monotonic()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                run_metrics.record_stage(stage, monotonic() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def get_error_category(error) -> str:
+    """
+    This function return the category of a Sheets API error for the run report
+    :param error:
+    :return:
+    """
+    if "שם אחר" in str(error.error_details):
+        return "duplicate title"
+    return {
+        400: "bad request",
+        401: "unauthorized",
+        403: "forbidden",
+        404: "not found",
+        429: "quota",
+        500: "server error",
+        503: "unavailable",
+    }.get(error.resp.status, "other")
+
+
+def execute_with_retries(request):
+    """
+    This function execute a Sheets API request under the shared rate limiter.
+    429/503 responses are retried with exponential backoff, other errors are raised
+    :param request:
+    :return:
+    """
+    method = getattr(request, "methodId", None) or getattr(request, "method", "")
+    bytes_sent = len(getattr(request, "body", None) or "")
+    for attempt in range(max_retries + 1):
+        rate_limiter.acquire()
+        start = monotonic()
+        try:
+            response = request.execute()
+        except HttpError as error:
+            run_metrics.record_api_call(method, monotonic() - start, bytes_sent, 0)
+            run_metrics.record_error(get_error_category(error))
+            if error.resp.status in (429, 503):
+                rate_limiter.on_throttle()
+            if error.resp.status not in retryable_statuses or attempt == max_retries:
+                raise
+            run_metrics.record_retry(error.resp.status)
+            backoff = min(64, 2**attempt) + random.uniform(0, 1)
+            logger.warning(
+                f"Got {error.resp.status}, retrying in {backoff:.1f} seconds"
+            )
+            sleep(backoff)
         else:
-            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open("token.json", "w") as token:
-            token.write(creds.to_json())
+            seconds = monotonic() - start
+            rate_limiter.on_response(seconds)
+            bytes_received = len(json.dumps(response, ensure_ascii=False).encode("utf-8"))
+            run_metrics.record_api_call(method, seconds, bytes_sent, bytes_received)
+            return response
+
+
+def get_credentials() -> Credentials:
+    """
+    This function load the credentials once per run and refresh them when they expire
+    :return:
+    """
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    global sheets_credentials
+    with service_lock:
+        creds = sheets_credentials
+        # The file token.json stores the user's access and refresh tokens, and is
+        # created automatically when the authorization flow completes for the first
+        # time.
+        if creds is None and os.path.exists("token.json"):
+            creds = Credentials.from_authorized_user_file("token.json", SCOPES)
+        # If there are no (valid) credentials available, let the user log in.
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    "credentials.json", SCOPES
+                )
+                creds = flow.run_local_server(port=0)
+            # Save the credentials for the next run
+            with open("token.json", "w") as token:
+                token.write(creds.to_json())
+        sheets_credentials = creds
+        return creds
+
+
+def get_authorized_http() -> google_auth_httplib2.AuthorizedHttp:
+    """
+    This function return the keep-alive authorized connection of the current thread
+    :return:
+    """
+    import google_auth_httplib2
+    import httplib2
+
+    if not hasattr(thread_local_http, "http"):
+        thread_local_http.http = google_auth_httplib2.AuthorizedHttp(
+            get_credentials(), http=httplib2.Http()
+        )
+    return thread_local_http.http
+
 
+def build_request(http, *args, **kwargs) -> HttpRequest:
+    """
+    This function is the requestBuilder of the service, so every request is sent
+    on the connection of the thread that executes it
+    """
+    from googleapiclient.http import HttpRequest
+
+    return HttpRequest(get_authorized_http(), *args, **kwargs)
+
+
+def get_service():
+    """
+    This function build the Sheets service once per run, from the discovery document that ships
+    with googleapiclient so no network fetch is needed
+    :return:
+    """
+    global sheets_service
+    with service_lock:
+        if sheets_service is None:
+            from googleapiclient.discovery import build
+
+            sheets_service = build(
+                "sheets",
+                "v4",
+                http=get_authorized_http(),
+                requestBuilder=build_request,
+                static_discovery=True,
+            )
+        return sheets_service
+
+
+@timed_stage("get_df")
+def get_df(spreadsheet_id, sheet_range=need_sheet_range, header_row_number=2) -> pd.DataFrame:
+    """
+    Get the Google sheet and convert it to a dataframe, with the columns of its header_row_number row
+    """
     try:
-        service = build("sheets", "v4", credentials=creds)
+        service = get_service()
 
         # Call the Sheets API
         sheet = service.spreadsheets()
-        result = (
-            sheet.values()
-            .get(spreadsheetId=spreadsheet_id, range="גיליון צריכים אירוח")
-            .execute()
+        result = execute_with_retries(
+            sheet.values().get(spreadsheetId=spreadsheet_id, range=sheet_range)
         )
         values = result.get("values", [])
 
@@ -62,7 +508,9 @@ def get_df(spreadsheet_id) -> pd.DataFrame:
 
 
         # Convert to a dataframe
-        df = pd.DataFrame.from_records(values[1:], columns=values[1])
+        df = pd.DataFrame.from_records(
+            values[header_row_number - 1 :], columns=values[header_row_number - 1]
+        )
 
     except HttpError as err:
         print(err)
@@ -70,47 +518,209 @@ def get_df(spreadsheet_id) -> pd.DataFrame:
     return df
 
 
-def init_spreadsheet(spreadsheet_id, gsheet_id):
+def column_letter(column) -> str:
     """
-    This function init the spreadsheet and return the my_range and service
+    This function convert a 0-based column index to its A1 letters (0 -> A, 26 -> AA)
+    :param column:
+    :return:
+    """
+    letters = ""
+    column += 1
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def get_sheet_title(spreadsheet_id, gsheet_id) -> str:
+    """
+    This function return the title of the tab whose id is gsheet_id, the id in the #gid= of its URL
     :param spreadsheet_id:
     :param gsheet_id:
     :return:
     """
-    # If modifying these scopes, delete the file token.json.
-    SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+    result = execute_with_retries(
+        get_service()
+        .spreadsheets()
+        .get(spreadsheetId=spreadsheet_id, fields="sheets.properties(sheetId,title)")
+    )
+    for sheet in result.get("sheets", []):
+        if sheet["properties"].get("sheetId", 0) == gsheet_id:
+            return sheet["properties"]["title"]
+    raise ValueError(f"No tab with the id {gsheet_id} in the spreadsheet {spreadsheet_id}")
+
+
+def get_header_row(spreadsheet_id, sheet_range=need_sheet_range) -> list:
+    """
+    This function return the headers of the sheet (its second row), without the " characters
+    :param spreadsheet_id:
+    :param sheet_range:
+    :return:
+    """
+    result = execute_with_retries(
+        get_service()
+        .spreadsheets()
+        .values()
+        .get(
+            spreadsheetId=spreadsheet_id,
+            range=f"'{sheet_range}'!2:2",
+            fields="values",
+        )
+    )
+    return [header.replace('"', "") for header in result.get("values", [[]])[0]]
+
+
+@timed_stage("get_df")
+def get_df_columns(
+    spreadsheet_id,
+    headers,
+    sheet_range=need_sheet_range,
+    start_row=2,
+    row_count=None,
+    blank_as_missing=(),
+    header_row=None,
+) -> pd.DataFrame:
+    """
+    Get only the given columns of the Google sheet and convert them to a dataframe.
+    The header row is read first to find the columns, then the columns are fetched with one
+    field-masked batchGet, so the other columns of the sheet are never downloaded.
+    Like get_df, the header is the second row and the index of sheet row r is r - 2
+    :param spreadsheet_id:
+    :param headers: the headers of the columns to fetch, without the " characters
+    :param sheet_range: the tab of the sheet
+    :param start_row: the first sheet row to fetch, for paging
+    :param row_count: the number of rows to fetch, or None for all the rows from start_row
+    :param blank_as_missing: headers whose blank cells are returned as None. get_df sees None
+        only when the blank cells are at the end of the row, a column read cannot know that
+    :param header_row: the result of get_header_row, to save its read when paging
+    :return:
+    """
+    sheet = get_service().spreadsheets()
+    if header_row is None:
+        header_row = get_header_row(spreadsheet_id, sheet_range)
+    positions = [i for i, header in enumerate(header_row) if header in headers]
+    missing_headers = set(headers) - {header_row[i] for i in positions}
+    if missing_headers:
+        raise ValueError(f"Columns not found in the google sheet: {missing_headers}")
+
+    end_row = "" if row_count is None else str(start_row + row_count - 1)
+    ranges = [
+        f"'{sheet_range}'!{column_letter(i)}{start_row}:{column_letter(i)}{end_row}"
+        for i in positions
+    ]
+    result = execute_with_retries(
+        sheet.values().batchGet(
+            spreadsheetId=spreadsheet_id,
+            ranges=ranges,
+            majorDimension="COLUMNS",
+            fields="valueRanges(values)",
+        )
+    )
+    columns = [
+        value_range.get("values", [[]])[0]
+        for value_range in result.get("valueRanges", [])
+    ]
+    # The API omits the empty cells at the end of every column
+    rows_number = max((len(column) for column in columns), default=0)
+    df = pd.DataFrame(
+        {
+            i: column + [""] * (rows_number - len(column))
+            for i, column in enumerate(columns)
+        },
+        index=pd.RangeIndex(start_row - 2, start_row - 2 + rows_number),
+    )
+    df.columns = [header_row[i] for i in positions]
+    for i, position in enumerate(positions):
+        if header_row[position] in blank_as_missing:
+            df.iloc[:, i] = df.iloc[:, i].replace("", None)
+    return df
 
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open("token.json", "w") as token:
-            token.write(creds.to_json())
 
+def init_spreadsheet(spreadsheet_id, gsheet_id):
+    """
+    This function init the spreadsheet and return the my_range and service
+    :param spreadsheet_id:
+    :param gsheet_id:
+    :return:
+    """
     try:
-        service = build("sheets", "v4", credentials=creds)
+        service = get_service()
 
-        my_range = {
-            "sheetId": gsheet_id,
-            "startRowIndex": 1,
-            "startColumnIndex": 0,
-        }
+        my_range = get_my_range(gsheet_id)
     except HttpError as error:
         print(f"An error occurred: {error}")
 
     return my_range, service
 
 
+def get_my_range(gsheet_id) -> dict:
+    """
+    This function return the range of the filter views of the sheet: all the rows below the title row
+    :param gsheet_id:
+    :return:
+    """
+    return {
+        "sheetId": gsheet_id,
+        "startRowIndex": 1,
+        "startColumnIndex": 0,
+    }
+
+
+class Answer(IntEnum):
+    """
+    Tri-state answer of the kosher, pets and mamad columns, as create_filter_view_request reads them
+    """
+
+    BLANK = 0  # "" - the column is not filtered
+    NO = 1  # "לא"
+    YES = 2  # any other answer, including nan - the column is filtered
+
+
+def get_answer_codes(values) -> np.ndarray:
+    """
+    This function convert a kosher, pets or mamad column to Answer codes
+    :param values:
+    :return:
+    """
+    values = pd.Series(values)
+    codes = np.full(len(values), Answer.YES, dtype=np.int8)
+    codes[(values == "").to_numpy()] = Answer.BLANK
+    codes[(values == "לא").to_numpy()] = Answer.NO
+    return codes
+
+
+# Criteria and sort specs that do not vary between the rows, so all the filter view requests
+# share the same dicts instead of building them again for every row
+not_contains_no_criteria = {
+    "condition": {
+        "type": "TEXT_NOT_CONTAINS",
+        "values": {"userEnteredValue": "לא"},
+    }
+}
+equals_no_criteria = {
+    "condition": {"type": "TEXT_EQ", "values": {"userEnteredValue": "לא"}}
+}
+hidden_statuses_criteria = {"hiddenValues": give_hidden_statuses}
+kosher_criteria = {"11": not_contains_no_criteria}
+not_kosher_criteria = {"12": equals_no_criteria}
+give_sort_specs = [
+    {
+        "dimensionIndex": number_of_guests_column,
+        "sortOrder": "ASCENDING",
+    },
+    {
+        "dimensionIndex": kosher_column,
+        "sortOrder": "ASCENDING",
+    },
+]
+date_sort_specs = [
+    {
+        "dimensionIndex": 0,  # I choose 0 because its the date column.
+        "sortOrder": "ASCENDING",
+    },
+]
+
+
 def apply_filter(kosher):
     """Applies the appropriate filter based on the value of the `kosher` variable.
         The logic of column 11 ('kosher' column):
@@ -125,20 +735,9 @@ def apply_filter(kosher):
     """
 
     if kosher != "לא" and kosher != "":
-        return {
-            "11": {
-                "condition": {
-                    "type": "TEXT_NOT_CONTAINS",
-                    "values": {"userEnteredValue": "לא"},
-                }
-            }
-        }
+        return kosher_criteria
     elif kosher == "לא":
-        return {
-            "12": {
-                "condition": {"type": "TEXT_EQ", "values": {"userEnteredValue": "לא"}}
-            }
-        }
+        return not_kosher_criteria
     else:
         return None
 
@@ -153,16 +752,7 @@ def create_filter_view_request(
             "filter": {
                 "title": index + "_" + full_name,
                 "range": my_range,
-                "sortSpecs": [
-                    {
-                        "dimensionIndex": number_of_guests_column,
-                        "sortOrder": "ASCENDING",
-                    },
-                    {
-                        "dimensionIndex": kosher_column,
-                        "sortOrder": "ASCENDING",
-                    },
-                ],
+                "sortSpecs": give_sort_specs,
                 "criteria": {
                     number_of_guests_column: {
                         "condition": {
@@ -170,25 +760,13 @@ def create_filter_view_request(
                             "values": {"userEnteredValue": number_of_guests},
                         }
                     },
-                    "22": {
-                        "hiddenValues": ["שובץ", "לא רלוונטי", "בטיפול"]
-                    },  # איפוס, בטיפול, או ריק
-                    "16": {
-                        "condition": {
-                            "type": "TEXT_NOT_CONTAINS",
-                            "values": {"userEnteredValue": "לא"},
-                        }
-                    }
+                    "22": hidden_statuses_criteria,  # איפוס, בטיפול, או ריק
+                    "16": not_contains_no_criteria
                     if (mamad != "לא" and mamad != "")
                     else None,  # todo: כל מה שלא מכיל "לא",
                     # The logic of column 16:
                     # if pets is not "לא" then filter all the rows that not contains "לא" in the pets column
-                    "15": {
-                        "condition": {
-                            "type": "TEXT_NOT_CONTAINS",
-                            "values": {"userEnteredValue": "לא"},
-                        }
-                    }
+                    "15": not_contains_no_criteria
                     if (pets != "לא" and pets != "")
                     else None,
                     # '16': {
@@ -214,6 +792,86 @@ def create_filter_view_request(
     return body
 
 
+def get_filter_criteria_template(kosher, pets, mamad) -> dict:
+    """
+    This function return the criteria of create_filter_view_request that depend only on the
+    Answer codes of the row, without the number of guests
+    :param kosher:
+    :param pets:
+    :param mamad:
+    :return:
+    """
+    criteria = {
+        "22": hidden_statuses_criteria,
+        "16": not_contains_no_criteria if mamad == Answer.YES else None,
+        "15": not_contains_no_criteria if pets == Answer.YES else None,
+    }
+    if kosher == Answer.YES:
+        criteria.update(kosher_criteria)
+    elif kosher == Answer.NO:
+        criteria.update(not_kosher_criteria)
+    return criteria
+
+
+# (kosher, pets, mamad) Answer codes -> the criteria template of the rows with these answers
+filter_criteria_templates = {
+    (int(kosher), int(pets), int(mamad)): get_filter_criteria_template(kosher, pets, mamad)
+    for kosher in Answer
+    for pets in Answer
+    for mamad in Answer
+}
+
+
+def create_filter_view_requests(need_house_df, my_range) -> list:
+    """
+    This function create the filter view requests of the need houses in one pass over their columns,
+    the same requests that create_filter_view_request creates row by row.
+    The number of guests is sent as the text of the cell, one criterion is shared by the rows with the
+    same text, and the kosher, pets and mamad answers are converted once to Answer codes that pick
+    the shared criteria templates
+    :param need_house_df: the need houses after clean_need_df
+    :param my_range:
+    :return:
+    """
+    titles = (need_house_df.index + 2).astype(str) + "_" + need_house_df["full name"].astype(str)
+    number_of_guests_criteria = {}
+    bodies = []
+    for title, number_of_guests, kosher, pets, mamad in zip(
+        titles.tolist(),
+        need_house_df["number of guests"].tolist(),
+        get_answer_codes(need_house_df["kosher"]).tolist(),
+        get_answer_codes(need_house_df["pets"]).tolist(),
+        get_answer_codes(need_house_df["mamad"]).tolist(),
+    ):
+        number_of_guests_criterion = number_of_guests_criteria.get(number_of_guests)
+        if number_of_guests_criterion is None:
+            number_of_guests_criterion = number_of_guests_criteria[number_of_guests] = {
+                "condition": {
+                    "type": "NUMBER_GREATER_THAN_EQ",
+                    "values": {"userEnteredValue": number_of_guests},
+                }
+            }
+        criteria = {number_of_guests_column: number_of_guests_criterion}
+        criteria.update(filter_criteria_templates[(kosher, pets, mamad)])
+        bodies.append(
+            {
+                "requests": [
+                    {
+                        "addFilterView": {
+                            "filter": {
+                                "title": title,
+                                "range": my_range,
+                                "sortSpecs": give_sort_specs,
+                                "criteria": criteria,
+                            }
+                        }
+                    }
+                ]
+            }
+        )
+    return bodies
+
+
 def update_spreadsheet(spreadsheet_id, body, service) -> bool:
     """
     This function update the spreadsheet with the filter`s body and return True if there is an error
@@ -224,38 +882,443 @@ def update_spreadsheet(spreadsheet_id, body, service) -> bool:
     """
     my_error = False
     try:
-        addfilterviewresponse = (
-            service.spreadsheets()
-            .batchUpdate(spreadsheetId=spreadsheet_id, body=body)
-            .execute()
+        addfilterviewresponse = execute_with_retries(
+            service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body)
         )
-        print(str(addfilterviewresponse))
+        logger.debug(str(addfilterviewresponse))
+        record_created_filter_views(addfilterviewresponse)
     except HttpError as error:
         print(f"An error occurred: {error}")
         if "שם אחר" in error.error_details:
-            people_that_have_filter.append(
-                body["requests"][0]["addFilterView"]["filter"]["title"]
-            )
+            # The filter view already exists. Only the families of the give pass are listed
+            # in people_that_have_filter, not the treatment and request type filter views
+            title = get_filter_view_title(body)
+            if family_filter_view_title.match(title):
+                people_that_have_filter.append(title)
         else:
             my_error = True
     return my_error
 
 
+def get_existing_filter_views(spreadsheet_id, service) -> dict:
+    """
+    This function return a title -> filterViewId index of the filter views that already exist
+    in the spreadsheet. The spreadsheet is fetched only once per run, with a fields mask so only
+    the filter views titles and ids are downloaded
+    :param spreadsheet_id:
+    :param service:
+    :return: the index, or None when the spreadsheet could not be read, so the callers fall back
+    to the state store and the "שם אחר" error instead of taking the spreadsheet as empty
+    """
+    if spreadsheet_id in filter_views_index:
+        return filter_views_index[spreadsheet_id]
+    existing_filter_views = {}
+    try:
+        result = execute_with_retries(
+            service.spreadsheets().get(
+                spreadsheetId=spreadsheet_id,
+                fields="sheets(filterViews(title,filterViewId))",
+            )
+        )
+        for sheet in result.get("sheets", []):
+            for filter_view in sheet.get("filterViews", []):
+                existing_filter_views[filter_view["title"]] = filter_view["filterViewId"]
+    except HttpError as error:
+        # Not cached, so the next pass reads the spreadsheet again
+        print(f"An error occurred: {error}")
+        return None
+    filter_views_index[spreadsheet_id] = existing_filter_views
+    return existing_filter_views
+
+
+def update_existing_filter_views(existing_filter_views, rows_titles) -> None:
+    """
+    This function add to the index the filter views that were created in this run
+    :param existing_filter_views:
+    :param rows_titles:
+    :return:
+    """
+    for title in rows_titles:
+        if title in created_filter_views:
+            existing_filter_views[title] = created_filter_views[title]
+
+
+class CheckpointJournal:
+    """
+    Append-only journal of every filter view request that was sent, flushed to disk after every batch.
+    A resumed run replays the journal and sends only the requests that were not done yet.
+    Only the entries of the previous run are skipped, and only when the request is the same, so a row
+    that changed, or whose filter view was deleted, in the current run is sent again
+    """
+
+    def __init__(self, path, resume=False):
+        """
+        :param path:
+        :param resume: replay the journal of the previous run instead of starting a new one
+        """
+        self.lock = threading.Lock()
+        # (spreadsheet_id, title) -> the last journal entry of the filter view
+        self.entries = {}
+        if resume and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    self.entries[(entry["spreadsheet_id"], entry["title"])] = entry
+        # The entries of the previous run, the only ones that is_done looks at
+        self.replayed = dict(self.entries)
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def is_done(self, spreadsheet_id, title, body_hash) -> bool:
+        """
+        Return True if the previous run sent the same request for the filter view without an error
+        """
+        entry = self.replayed.get((spreadsheet_id, title))
+        return (
+            entry is not None
+            and entry["status"] == "created"
+            and entry.get("body hash") == body_hash
+        )
+
+    def record(self, spreadsheet_id, entries) -> None:
+        """
+        Append (title, row, status, body hash) entries to the journal and flush it to disk.
+        The status is "created", "exists" or "error", and the body hash is None for "exists"
+        """
+        with self.lock:
+            for title, row, status, body_hash in entries:
+                entry = {
+                    "spreadsheet_id": spreadsheet_id,
+                    "title": title,
+                    "row": row,
+                    "status": status,
+                    "body hash": body_hash,
+                }
+                self.entries[(spreadsheet_id, title)] = entry
+                self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def get_people_that_have_filter(self, spreadsheet_id) -> list:
+        """
+        Return the titles of the filter views that already existed in the spreadsheet
+        """
+        return [
+            entry["title"]
+            for (entry_spreadsheet_id, _), entry in self.entries.items()
+            if entry_spreadsheet_id == spreadsheet_id and entry["status"] == "exists"
+        ]
+
+    def get_rows_with_errors(self, spreadsheet_id) -> list:
+        """
+        Return the rows whose last request in the spreadsheet failed
+        """
+        return [
+            entry["row"]
+            for (entry_spreadsheet_id, _), entry in self.entries.items()
+            if entry_spreadsheet_id == spreadsheet_id and entry["status"] == "error"
+        ]
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def record_checkpoint(spreadsheet_id, bodies, rows, rows_with_errors) -> None:
+    """
+    This function record in the checkpoint journal the result of every body of a batch
+    :param spreadsheet_id:
+    :param bodies:
+    :param rows:
+    :param rows_with_errors: the rows of the batch that have errors
+    :return:
+    """
+    if checkpoint_journal is None:
+        return
+    entries = []
+    for body, row in zip(bodies, rows):
+        title = get_filter_view_title(body)
+        if row in rows_with_errors:
+            status = "error"
+        elif title in created_filter_views:
+            status = "created"
+        else:
+            status = "exists"
+        entries.append((title, row, status, get_body_hash(body)))
+    checkpoint_journal.record(spreadsheet_id, entries)
+
+
+def get_body_hash(body) -> str:
+    """
+    This function return the hash of a filter`s body, so the journal can tell a changed request
+    from the one it already sent
+    :param body:
+    :return:
+    """
+    return hashlib.sha1(
+        json.dumps(body, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def get_filter_view_title(body) -> str:
+    """
+    This function return the title of the filter view that the body adds
+    :param body:
+    :return:
+    """
+    for request in body["requests"]:
+        if "addFilterView" in request:
+            return request["addFilterView"]["filter"]["title"]
+    return ""
+
+
+def record_created_filter_views(response) -> None:
+    """
+    This function save the filterViewId of every filter view that was added by the batchUpdate response
+    :param response:
+    :return:
+    """
+    for reply in response.get("replies", []):
+        if "addFilterView" in reply:
+            filter_view = reply["addFilterView"]["filter"]
+            created_filter_views[filter_view["title"]] = filter_view["filterViewId"]
+
+
+def merge_request_bodies(bodies) -> dict:
+    """
+    This function merge many filter`s bodies into one batchUpdate body
+    :param bodies:
+    :return:
+    """
+    return {"requests": [request for body in bodies for request in body["requests"]]}
+
+
+def update_spreadsheet_chunk(spreadsheet_id, bodies, rows, service) -> list:
+    """
+    This function send a chunk of bodies in one batchUpdate and return the rows that have errors.
+    batchUpdate is atomic, so when a request of the chunk fails it is split in half and each half
+    is retried until the bad rows are found. When the chunk still gets a 429 or 503 after the
+    retries of execute_with_retries, the whole chunk is an error and it is not split, so an exhausted
+    quota is not hit again with smaller chunks
+    :param spreadsheet_id:
+    :param bodies:
+    :param rows:
+    :param service:
+    :return:
+    """
+    if len(bodies) == 1:
+        error = update_spreadsheet(spreadsheet_id, bodies[0], service)
+        return [rows[0]] if error else []
+    try:
+        addfilterviewresponse = execute_with_retries(
+            service.spreadsheets().batchUpdate(
+                spreadsheetId=spreadsheet_id, body=merge_request_bodies(bodies)
+            )
+        )
+        logger.debug(str(addfilterviewresponse))
+        record_created_filter_views(addfilterviewresponse)
+        return []
+    except HttpError as error:
+        print(f"An error occurred in a chunk of {len(bodies)} requests: {error}")
+        if error.resp.status in retryable_statuses:
+            return list(rows)
+    middle = len(bodies) // 2
+    return update_spreadsheet_chunk(
+        spreadsheet_id, bodies[:middle], rows[:middle], service
+    ) + update_spreadsheet_chunk(spreadsheet_id, bodies[middle:], rows[middle:], service)
+
+
+@timed_stage("update_spreadsheet")
+def update_spreadsheet_in_batches(
+    spreadsheet_id, bodies, rows, service, batch_size=1
+) -> tuple:
+    """
+    This function send the filter`s bodies in chunks of batch_size requests per batchUpdate
+    and return the rows that have errors and the rows that were sent.
+    The pacing is done by the shared rate limiter
+    :param spreadsheet_id:
+    :param bodies: list of bodies, one per row
+    :param rows: list of [full name, row number], one per body
+    :param service:
+    :param batch_size:
+    :return: the rows with errors and the sent rows, without the ones the previous run already did
+    """
+    from tqdm import tqdm
+
+    if checkpoint_journal is not None:
+        # Skip the requests that the previous run of the journal already did
+        pending = [
+            (body, row)
+            for body, row in zip(bodies, rows)
+            if not checkpoint_journal.is_done(
+                spreadsheet_id, get_filter_view_title(body), get_body_hash(body)
+            )
+        ]
+        bodies = [body for body, _ in pending]
+        rows = [row for _, row in pending]
+    rows_with_errors = []
+    for start in tqdm(range(0, len(bodies), batch_size)):
+        chunk_bodies = bodies[start : start + batch_size]
+        chunk_rows = rows[start : start + batch_size]
+        chunk_errors = update_spreadsheet_chunk(
+            spreadsheet_id, chunk_bodies, chunk_rows, service
+        )
+        record_checkpoint(spreadsheet_id, chunk_bodies, chunk_rows, chunk_errors)
+        rows_with_errors += chunk_errors
+    return rows_with_errors, rows
+
+
+class SnapshotStore:
+    """
+    Local snapshots of the fetched sheets, one pickled dataframe per sheet with its fetch time and
+    content hash, so debugging runs and single passes do not read the sheets from the API again
+    """
+
+    def __init__(self, directory, ttl=None, offline=False):
+        """
+        :param directory:
+        :param ttl: seconds a snapshot is used before the sheet is fetched again, None never expires
+        :param offline: always use the snapshot and never fetch the sheet
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.offline = offline
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, *key) -> str:
+        """
+        Return the path of the snapshot of the key, without the extension
+        """
+        name = hashlib.sha256(json.dumps(key, ensure_ascii=False).encode("utf-8"))
+        return os.path.join(self.directory, name.hexdigest()[:16])
+
+    def get_metadata(self, *key):
+        """
+        Return the fetch time and the hash of the snapshot, or None when there is no snapshot
+        """
+        path = self.get_path(*key)
+        if not os.path.exists(path + ".json"):
+            return None
+        with open(path + ".json", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load(self, *key):
+        """
+        Return the snapshot of the key, or None when there is no snapshot or it expired
+        """
+        metadata = self.get_metadata(*key)
+        if metadata is None:
+            if self.offline:
+                raise ValueError(f"No snapshot of {key} to run offline")
+            return None
+        age = time() - metadata["fetched at"]
+        if not self.offline and self.ttl is not None and age > self.ttl:
+            return None
+        logger.info(f"Using the snapshot of {key} from {age:.0f} seconds ago")
+        return pd.read_pickle(self.get_path(*key) + ".pkl")
+
+    def save(self, df, *key) -> None:
+        """
+        Save the fetched dataframe. An unchanged sheet only refreshes the fetch time of its snapshot
+        """
+        path = self.get_path(*key)
+        content_hash = hashlib.sha256(
+            pd.util.hash_pandas_object(df).to_numpy().tobytes()
+            + json.dumps(list(df.columns), ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        with self.lock:
+            metadata = self.get_metadata(*key)
+            if metadata is None or metadata["hash"] != content_hash:
+                # Write to a temporary file first, so a killed run never leaves half a snapshot
+                df.to_pickle(path + ".pkl.tmp")
+                os.replace(path + ".pkl.tmp", path + ".pkl")
+            with open(path + ".json", "w", encoding="utf-8") as f:
+                json.dump(
+                    {"key": key, "fetched at": time(), "hash": content_hash},
+                    f,
+                    ensure_ascii=False,
+                )
+
+
 def get_df_from_google_sheet(
-    df_type: str = "", give_spreadsheet_id: str = "", need_spreadsheet_id: str = ""
+    df_type: str = "",
+    give_spreadsheet_id: str = "",
+    need_spreadsheet_id: str = "",
+    only_used_columns: bool = False,
+    give_gsheet_id: int = 0,
+    give_header_row_number: int = 2,
 ) -> pd.DataFrame:
     if not df_type:
         return None
     if df_type == "need_df":
         spreadsheet_id = need_spreadsheet_id
+        snapshot_key = (spreadsheet_id, need_sheet_range, only_used_columns)
     elif df_type == "give_df":
         spreadsheet_id = give_spreadsheet_id
+        # The title of the give tab is read only when the tab is fetched, so offline runs need no API call
+        snapshot_key = (spreadsheet_id, give_gsheet_id, give_header_row_number, only_used_columns)
+
+    if snapshot_store is not None:
+        df = snapshot_store.load(*snapshot_key)
+        if df is not None:
+            return df
+
+    if df_type == "give_df":
+        df = get_df(
+            spreadsheet_id,
+            get_sheet_title(spreadsheet_id, give_gsheet_id),
+            give_header_row_number,
+        )
+    elif only_used_columns:
+        # Fetch only the columns that clean_need_df keeps
+        df = get_df_columns(
+            spreadsheet_id,
+            list(need_columns_rename),
+            need_sheet_range,
+            blank_as_missing=need_blank_as_missing,
+        )
+    else:
+        df = get_df(spreadsheet_id, need_sheet_range)
 
-    df = get_df(spreadsheet_id)
-
+    if snapshot_store is not None:
+        snapshot_store.save(df, *snapshot_key)
     return df
 
 
+def get_need_df_blocks(need_spreadsheet_id, block_size, dedup_mode=None):
+    """
+    This generator page through the need houses sheet in blocks of block_size rows.
+    Every block is cleaned as it arrives and only its active rows are yielded, so the filters
+    of the first blocks are created before the last rows are read and the memory stays flat
+    :param need_spreadsheet_id:
+    :param block_size:
+    :param dedup_mode: "collapse" or "flag" the repeated submissions with dedup_need_df, None keeps them.
+    The rows of every block are compared with the rows of the earlier blocks too
+    :return:
+    """
+    header_row = get_header_row(need_spreadsheet_id, need_sheet_range)
+    duplicate_finder = DuplicateFinder()
+    start_row = 2
+    while True:
+        need_house_df = get_df_columns(
+            need_spreadsheet_id,
+            list(need_columns_rename),
+            need_sheet_range,
+            start_row,
+            block_size,
+            blank_as_missing=need_blank_as_missing,
+            header_row=header_row,
+        )
+        if need_house_df.empty:
+            return
+        need_house_df = clean_need_df(need_house_df)
+        if dedup_mode:
+            need_house_df = dedup_need_df(need_house_df, dedup_mode, duplicate_finder)
+        yield need_house_df
+        start_row += block_size
+
+
 def pre_clean_data(df) -> pd.DataFrame:
     """
     This function clean the data before the main cleaning
@@ -270,6 +1333,153 @@ def pre_clean_data(df) -> pd.DataFrame:
     return df
 
 
+class RequestStatus(Enum):
+    """
+    The classes of the "request status" column of the need houses
+    """
+
+    PENDING = "pending"  # no status yet
+    IN_TREATMENT = "in treatment"  # בטיפול
+    RESET = "reset"  # איפוס
+    WAITING = "waiting"  # ממתינים לבית ריק
+    DONE = "done"  # any other status, like שובץ or לא רלוונטי
+
+
+# The need houses with these statuses still need a house
+active_request_statuses = [
+    RequestStatus.PENDING,
+    RequestStatus.IN_TREATMENT,
+    RequestStatus.RESET,
+    RequestStatus.WAITING,
+]
+request_status_pattern = re.compile(
+    "(?P<IN_TREATMENT>בטיפול)|(?P<RESET>איפוס)|(?P<WAITING>ממתינים לבית ריק)"
+)
+
+
+def classify_request_status(status) -> RequestStatus:
+    """
+    This function classify one value of the "request status" column
+    :param status:
+    :return:
+    """
+    if pd.isna(status):
+        return RequestStatus.PENDING
+    match = request_status_pattern.search(str(status))
+    if match is None:
+        return RequestStatus.DONE
+    return RequestStatus[match.lastgroup]
+
+
+def classify_request_statuses(statuses) -> pd.Series:
+    """
+    This function classify the "request status" column into a categorical of RequestStatus values.
+    The column is converted to a categorical once, so the matcher runs once per distinct status
+    instead of once per row
+    :param statuses:
+    :return:
+    """
+    statuses = statuses.astype("category")
+    all_statuses = list(RequestStatus)
+    # The last class is of the nan statuses, whose category code is -1
+    classes_codes = np.array(
+        [
+            all_statuses.index(classify_request_status(status))
+            for status in statuses.cat.categories
+        ]
+        + [all_statuses.index(RequestStatus.PENDING)],
+        dtype=np.int8,
+    )
+    return pd.Series(
+        pd.Categorical.from_codes(
+            classes_codes[statuses.cat.codes.to_numpy()],
+            categories=[status.value for status in all_statuses],
+        ),
+        index=statuses.index,
+    )
+
+
+def get_active_requests_mask(statuses) -> np.ndarray:
+    """
+    This function return the mask of the need houses that still need a house, from the category codes
+    of classify_request_statuses
+    :param statuses:
+    :return:
+    """
+    all_statuses = list(RequestStatus)
+    active_codes = [all_statuses.index(status) for status in active_request_statuses]
+    return np.isin(classify_request_statuses(statuses).cat.codes.to_numpy(), active_codes)
+
+
+# The filter views of the families are sent by the lane of their status, in this order
+request_status_priorities = [
+    RequestStatus.PENDING,
+    RequestStatus.WAITING,
+    RequestStatus.IN_TREATMENT,
+    RequestStatus.RESET,
+    RequestStatus.DONE,
+]
+# The format of the form timestamp column
+need_timestamp_format = "%d/%m/%Y %H:%M:%S"
+
+
+def get_send_order(need_house_df) -> np.ndarray:
+    """
+    This function return the positions of the need houses in the order their filter views are sent.
+    The lane of a family is the priority of its status, and within a status the families that must
+    have a mamad go first. Inside a lane the oldest submission goes first, by the form timestamp
+    :param need_house_df: the need houses after clean_need_df
+    :return:
+    """
+    all_statuses = list(RequestStatus)
+    status_priorities = np.array(
+        [request_status_priorities.index(status) for status in all_statuses]
+    )
+    status_codes = classify_request_statuses(need_house_df["request status"]).cat.codes
+    lanes = status_priorities[status_codes.to_numpy()] * 2 + (
+        get_answer_codes(need_house_df["mamad"]) != Answer.YES
+    )
+    submitted = np.zeros(len(need_house_df), dtype=np.int64)
+    if "timestamp" in need_house_df.columns:
+        timestamps = pd.to_datetime(
+            need_house_df["timestamp"], format=need_timestamp_format, errors="coerce"
+        )
+        # The rows without a timestamp go last in their lane
+        submitted = np.where(
+            timestamps.isna(),
+            np.iinfo(np.int64).max,
+            timestamps.to_numpy(dtype="datetime64[ns]").astype(np.int64),
+        )
+    return np.lexsort((np.arange(len(need_house_df)), submitted, lanes))
+
+
+def get_typed_need_df(need_house_df) -> pd.DataFrame:
+    """
+    This function convert the need houses after clean_need_df to a compact typed struct of arrays:
+    integer number of guests ("זוג" is already 2), Answer codes for kosher, pets and mamad,
+    and categoricals for the treatment and the request status
+    :param need_house_df:
+    :return:
+    """
+    number_of_guests = np.ceil(
+        pd.to_numeric(need_house_df["number of guests"], errors="coerce")
+    )
+    return pd.DataFrame(
+        {
+            "full name": need_house_df["full name"].to_numpy(),
+            "number of guests": number_of_guests.astype("Int32"),
+            "kosher": get_answer_codes(need_house_df["kosher"]),
+            "pets": get_answer_codes(need_house_df["pets"]),
+            "mamad": get_answer_codes(need_house_df["mamad"]),
+            "treatment": need_house_df["treatment"].astype("category"),
+            "request status": need_house_df["request status"].astype("category"),
+            "status class": classify_request_statuses(need_house_df["request status"]),
+        },
+        index=need_house_df.index,
+    )
+
+
+@timed_stage("clean_need_df")
 def clean_need_df(need_house_df) -> pd.DataFrame:
     """
     This function clean the need_house_df
@@ -280,113 +1490,443 @@ def clean_need_df(need_house_df) -> pd.DataFrame:
     need_house_df = pre_clean_data(need_house_df)
 
     # Rename the columns to English
-    need_house_df = need_house_df.rename(
-        columns={
-            # "חותמת זמן": "timestamp",
-            # "כתובת אימייל": "email address",
-            "שם מלא": "full name",
-            # "טלפון  (אנא ציינו רק ספרות, ללא מקף ורווח)": "phone number",
-            # "מאיזה יישוב אתם מגיעים ?  ": "origin city",
-            "מה מספר אורחים שצריכים מקום?": "number of guests",
-            # "הערות/בקשות": "notes/requests",
-            "האם יש בעח שבאים איתכם ?": "pets",
-            # "האם זקוקים לעזרה בהסעות?": "transportation assistance",
-            "האם שומרי כשרות?": "kosher",
-            # "האם זקוקים לבית מונגש ?": "accessible",
-            # "פירוט על בעח": "pets details",
-            # "פירוט לגבי בית מונגש": "accessible details",
-            # "פירוט לגבי כשרות": "kosher details",
-            # "הערות": "notes",
-            "בטיפול של מי?": "treatment",
-            # "אצל מי מתארחים": "who is hosting",
-            # "שונות": "other",
-            "מצב הבקשה": "request status",
-            # "Unnamed: 19": "unknown",
-            "האם חובה ממד  ?(שימו לב-  בית עם מקלט במקום ממד מזרז משמעותית זמני טיפול) ": "mamad",
-        }
+    need_house_df = need_house_df.rename(columns=need_columns_rename)
+    need_house_df = post_clean_data(need_house_df)
+
+    # Filter only rows that have nan in the "request status" column or have "בטיפול", "איפוס"
+    # or "ממתינים לבית ריק" in the "request status" column
+    need_house_df = need_house_df[
+        get_active_requests_mask(need_house_df["request status"])
+    ]
+
+    # If pets column appear twice so drop only one of them
+    try:
+        if need_house_df["pets"].shape[1] == 2:
+            pets_column = need_house_df["pets"].iloc[:, 0]
+            need_house_df = need_house_df.drop(columns=["pets"])
+            need_house_df["pets"] = pets_column
+    except IndexError:
+        pass
+    # Reset index
+    # need_house_df = need_house_df.reset_index()
+    return need_house_df
+
+
+def post_clean_data(df) -> pd.DataFrame:
+    """
+    This function clean the data after the main cleaning
+    :param df:
+    :return:
+    """
+    # Filter rows that have nan in the "number of guests" column
+    df = df[df["number of guests"].notna()]
+
+    # Convert the "number of guests" column to string
+    df["number of guests"] = df["number of guests"].astype(str)
+
+    # Convert the "can have pets" column to string
+    df["pets"] = df["pets"].astype(str)
+
+    # Convert the "kosher" column to string
+    df["kosher"] = df["kosher"].astype(str)
+
+    return df
+
+
+# Niqqud, punctuation and the words that only say "family", removed before comparing names
+name_noise_pattern = re.compile(r"[\u0591-\u05C7]|[^\w\s]|_|\bמשפחת\b|\bמשפחה\b")
+final_letters = str.maketrans("ךםןףץ", "כמנפצ")
+# Blocks with more rows than this (a very common surname) are not compared, to keep the work near-linear
+dedup_max_block_size = 50
+# Two names at least this similar are the same family
+same_name_similarity = 0.9
+# Two names at least this similar, with the same phone number, are the same family
+same_phone_name_similarity = 0.6
+
+
+def normalize_names(names) -> pd.Series:
+    """
+    This function normalize the full names for comparing them: without niqqud, punctuation and
+    the word family, with regular letters instead of final ones, and with the words sorted,
+    so "כהן משה" and "משה כהן" are the same
+    :param names:
+    :return:
+    """
+    # One pass of plain string methods per name is faster than a chain of pandas str methods
+    return pd.Series(
+        [
+            " ".join(sorted(name_noise_pattern.sub(" ", name.lower()).translate(final_letters).split()))
+            for name in names.fillna("").astype(str).tolist()
+        ],
+        index=names.index,
+    )
+
+
+def normalize_phones(phones) -> pd.Series:
+    """
+    This function normalize the phone numbers to their digits, with a local 0 instead of +972.
+    Numbers that are too short to be real are blank
+    :param phones:
+    :return:
+    """
+    phones = phones.fillna("").astype(str).str.replace(r"\D", "", regex=True)
+    phones = phones.str.replace(r"^972", "0", regex=True)
+    phones = phones.where(phones.str.startswith("0"), "0" + phones)
+    return phones.where(phones.str.len() >= 9, "")
+
+
+class DuplicateFinder:
+    """
+    The names, phones and blocks of the need rows seen so far, so the rows of every new block of the
+    stream or poll of the watch mode are compared with all the earlier rows, not only with each other.
+    Only the rows that share a block, the last 7 digits of the phone or a word of the name, are compared,
+    and a name block pairs only rows where one of the phones is blank: two rows with different phones
+    are never the same family, and rows with the same phone already share a phone block
+    """
+
+    def __init__(self):
+        self.names = []
+        self.phones = []
+        self.rows = []
+        self.positions = {}
+        self.first_submission = []
+        # block -> positions, the name blocks are split to the positions with and without a phone
+        self.phone_blocks = defaultdict(list)
+        self.name_blocks_with_phone = defaultdict(list)
+        self.name_blocks_without_phone = defaultdict(list)
+
+    def find(self, position) -> int:
+        """
+        Return the position of the first submission of the family of the row, with path halving
+        """
+        first_submission = self.first_submission
+        while first_submission[position] != position:
+            first_submission[position] = first_submission[first_submission[position]]
+            position = first_submission[position]
+        return position
+
+    def get_candidate_pairs(self, start) -> set:
+        """
+        Return the pairs of positions, with at least one from start on, that share a block of up to
+        dedup_max_block_size rows
+        """
+        candidate_pairs = set()
+        touched_phone_blocks = {"phone " + phone[-7:] for phone in self.phones[start:] if phone}
+        for key in touched_phone_blocks:
+            positions = self.phone_blocks[key]
+            if 1 < len(positions) <= dedup_max_block_size:
+                split = bisect.bisect_left(positions, start)
+                candidate_pairs.update(itertools.product(positions[:split], positions[split:]))
+                candidate_pairs.update(itertools.combinations(positions[split:], 2))
+        touched_name_blocks = {word for name in self.names[start:] for word in name.split()}
+        for word in touched_name_blocks:
+            with_phone = self.name_blocks_with_phone[word]
+            without_phone = self.name_blocks_without_phone[word]
+            if not without_phone or len(with_phone) + len(without_phone) > dedup_max_block_size:
+                continue
+            split_with = bisect.bisect_left(with_phone, start)
+            split_without = bisect.bisect_left(without_phone, start)
+            # The new rows without a phone against all the earlier rows and each other
+            for position in without_phone[split_without:]:
+                candidate_pairs.update(
+                    (other, position) for other in with_phone if other < position
+                )
+                candidate_pairs.update(
+                    (other, position) for other in without_phone if other < position
+                )
+            # The new rows with a phone against the earlier rows without one
+            for position in with_phone[split_with:]:
+                candidate_pairs.update(
+                    (other, position) for other in without_phone if other < position
+                )
+        return candidate_pairs
+
+    def is_same_family(self, first, second) -> bool:
+        """
+        Compare two rows by the similarity of their names and their phones
+        """
+        first_phone, second_phone = self.phones[first], self.phones[second]
+        same_phone = first_phone and first_phone == second_phone
+        if first_phone and second_phone and not same_phone:
+            # Two families with the same name and different phones
+            return False
+        threshold = same_phone_name_similarity if same_phone else same_name_similarity
+        matcher = difflib.SequenceMatcher(None, self.names[first], self.names[second])
+        return matcher.quick_ratio() >= threshold and matcher.ratio() >= threshold
+
+    def add(self, names, phones, rows) -> np.ndarray:
+        """
+        Add rows and return the position of the first submission of the family of every one of them.
+        A row that was already added, like a row that the watch mode reads twice, is not added again
+        :param names: the result of normalize_names
+        :param phones: the result of normalize_phones
+        :param rows: the index of the rows in the need houses dataframe
+        :return:
+        """
+        rows = list(rows)
+        start = len(self.names)
+        for name, phone, row in zip(names.tolist(), phones.tolist(), rows):
+            if row in self.positions:
+                continue
+            position = len(self.names)
+            self.positions[row] = position
+            self.names.append(name)
+            self.phones.append(phone)
+            self.rows.append(row)
+            self.first_submission.append(position)
+            if phone:
+                self.phone_blocks["phone " + phone[-7:]].append(position)
+                name_blocks = self.name_blocks_with_phone
+            else:
+                name_blocks = self.name_blocks_without_phone
+            for word in set(name.split()):
+                name_blocks[word].append(position)
+
+        for first, second in self.get_candidate_pairs(start):
+            if self.is_same_family(first, second):
+                first, second = self.find(first), self.find(second)
+                if first != second:
+                    self.first_submission[max(first, second)] = min(first, second)
+        return np.array([self.find(self.positions[row]) for row in rows], dtype=np.int64)
+
+
+@timed_stage("dedup_need_df")
+def dedup_need_df(need_house_df, mode="collapse", duplicate_finder=None) -> pd.DataFrame:
+    """
+    This function find the families that submitted the form more than once, by their names and phones.
+    The first submission of every family is kept: "collapse" drops the other submissions and "flag"
+    keeps them with the row of the first submission in the "duplicate of" column
+    :param need_house_df: the need houses after clean_need_df
+    :param mode: "collapse" or "flag"
+    :param duplicate_finder: the DuplicateFinder of the earlier blocks of the same sheet, None compares
+    the rows only with each other
+    :return:
+    """
+    if duplicate_finder is None:
+        duplicate_finder = DuplicateFinder()
+    if "phone number" in need_house_df.columns:
+        phones = normalize_phones(need_house_df["phone number"])
+    else:
+        phones = pd.Series("", index=need_house_df.index)
+    first_submission = duplicate_finder.add(
+        normalize_names(need_house_df["full name"]), phones, need_house_df.index
+    )
+    positions = np.array(
+        [duplicate_finder.positions[row] for row in need_house_df.index], dtype=np.int64
     )
-    need_house_df = post_clean_data(need_house_df)
-
-    # Filter only rows that have nan in the "request status" column or have "בטיפול" in the "request status" column
-    need_house_df = need_house_df[
-        need_house_df["request status"].isna()
-        | need_house_df["request status"].str.contains("בטיפול")
-        | need_house_df["request status"].str.contains("איפוס")
-        | need_house_df["request status"].str.contains("ממתינים לבית ריק")
-        | need_house_df["request status"].str.contains("איפוס (להחזיר שורה ללבנה)")
-    ]
 
-    # If pets column appear twice so drop only one of them
-    try:
-        if need_house_df["pets"].shape[1] == 2:
-            pets_column = need_house_df["pets"].iloc[:, 0]
-            need_house_df = need_house_df.drop(columns=["pets"])
-            need_house_df["pets"] = pets_column
-    except IndexError:
-        pass
-    # Reset index
-    # need_house_df = need_house_df.reset_index()
+    is_duplicate = first_submission != positions
+    logger.info(f"{is_duplicate.sum()} need rows are duplicate submissions")
+    if mode == "collapse":
+        return need_house_df[~is_duplicate]
+    need_house_df = need_house_df.copy()
+    duplicate_of = pd.array(
+        np.array(duplicate_finder.rows, dtype=np.int64)[first_submission] + 2, dtype="Int64"
+    )
+    duplicate_of[~is_duplicate] = pd.NA
+    need_house_df["duplicate of"] = duplicate_of
     return need_house_df
 
 
-def post_clean_data(df) -> pd.DataFrame:
+def open_state_store(state_db_path) -> sqlite3.Connection:
     """
-    This function clean the data after the main cleaning
-    :param df:
+    This function open the local state store of the need rows that already have a filter view.
+    Every row is saved with the hash of the fields that feed create_filter_view_request
+    :param state_db_path:
     :return:
     """
-    # Filter rows that have nan in the "number of guests" column
-    df = df[df["number of guests"].notna()]
+    state = sqlite3.connect(state_db_path)
+    state.execute(
+        "CREATE TABLE IF NOT EXISTS filter_views ("
+        "spreadsheet_id TEXT, row TEXT, fields_hash TEXT, title TEXT, filter_view_id INTEGER, "
+        "PRIMARY KEY (spreadsheet_id, row))"
+    )
+    return state
 
-    # Convert the "number of guests" column to string
-    df["number of guests"] = df["number of guests"].astype(str)
 
-    # Convert the "can have pets" column to string
-    df["pets"] = df["pets"].astype(str)
+def need_row_hash(full_name, number_of_guests, kosher, pets, mamad) -> str:
+    """
+    This function return the hash of the fields that feed create_filter_view_request
+    :param full_name:
+    :param number_of_guests:
+    :param kosher:
+    :param pets:
+    :param mamad:
+    :return:
+    """
+    fields = "\x1f".join(
+        str(field) for field in [full_name, number_of_guests, kosher, pets, mamad]
+    )
+    return hashlib.sha1(fields.encode("utf-8")).hexdigest()
 
-    # Convert the "kosher" column to string
-    df["kosher"] = df["kosher"].astype(str)
 
-    return df
+def get_synced_row(state, spreadsheet_id, index):
+    """
+    This function return the (fields_hash, title, filter_view_id) saved for the row, or None for a new row
+    :param state:
+    :param spreadsheet_id:
+    :param index:
+    :return:
+    """
+    return state.execute(
+        "SELECT fields_hash, title, filter_view_id FROM filter_views WHERE spreadsheet_id = ? AND row = ?",
+        (spreadsheet_id, index),
+    ).fetchone()
 
 
-def give_filters(need_house_df, my_range, service, spreadsheet_id) -> list:
+def save_synced_rows(
+    state, spreadsheet_id, rows, hashes, rows_with_errors, filter_view_ids
+) -> None:
+    """
+    This function save to the state store the rows that were sent without errors
+    :param state:
+    :param spreadsheet_id:
+    :param rows: list of [full name, row number]
+    :param hashes: the need_row_hash of every row
+    :param rows_with_errors:
+    :param filter_view_ids: title -> filterViewId of the rows filter views
+    :return:
     """
-    This function add filter views to the give houses spreadsheet
+    synced_rows = []
+    for (full_name, index), fields_hash in zip(rows, hashes):
+        if [full_name, index] in rows_with_errors:
+            continue
+        title = index + "_" + full_name
+        synced_rows.append(
+            (spreadsheet_id, index, fields_hash, title, filter_view_ids.get(title))
+        )
+    state.executemany(
+        "INSERT INTO filter_views VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (spreadsheet_id, row) DO UPDATE SET "
+        "fields_hash = excluded.fields_hash, title = excluded.title, "
+        "filter_view_id = COALESCE(excluded.filter_view_id, filter_views.filter_view_id)",
+        synced_rows,
+    )
+    state.commit()
+
+
+@timed_stage("give_filters")
+def give_filters(
+    need_house_df,
+    my_range,
+    service,
+    spreadsheet_id,
+    batch_size=1,
+    state=None,
+    existing_filter_views=None,
+) -> list:
+    """
+    This function add filter views to the give houses spreadsheet, in the order of get_send_order.
+    When a state store is given, only rows that are new or changed since the last run are sent
     :param need_house_df:
     :param my_range:
     :param service:
     :param spreadsheet_id:
+    :param batch_size: number of addFilterView requests to send in one batchUpdate
+    :param state: the state store from open_state_store, or None to send every row
+    :param existing_filter_views: title -> filterViewId index from get_existing_filter_views,
+    or None when the filter views of the spreadsheet are not known
     :return:
     """
-    rows_with_errors = []
-    tqdm_need_houses = tqdm(need_house_df.iterrows())
-    n = 1
+    known_filter_views = existing_filter_views is not None
+    if existing_filter_views is None:
+        existing_filter_views = {}
+    need_house_df = need_house_df.iloc[get_send_order(need_house_df)]
+    # The positions of the rows to send and the filter views to delete before sending them
+    send_positions = []
+    old_filter_view_ids = []
+    rows = []
+    hashes = []
+    existing_rows = []
+    existing_hashes = []
+    existing_entries = []
     # iterate through the need houses
-    for i, row in tqdm_need_houses:
-        # if row['full name'] != 'אהרון אילנית':
-        #     continue
-        # if n < 166:
-        #     n += 1
+    for position, (i, full_name, number_of_guests, kosher, pets, mamad) in enumerate(
+        zip(
+            need_house_df.index,
+            need_house_df["full name"].to_numpy(),
+            need_house_df["number of guests"].to_numpy(),
+            need_house_df["kosher"].to_numpy(),
+            need_house_df["pets"].to_numpy(),
+            need_house_df["mamad"].to_numpy(),
+        )
+    ):
+        # if full_name != 'אהרון אילנית':
         #     continue
-        body = create_filter_view_request(
-            my_range,
-            row["full name"],
-            str(i + 2),
-            row["number of guests"],
-            row["kosher"],
-            row["pets"],
-            # row['accessible'],
-            row["mamad"],
-        )
-        error = update_spreadsheet(spreadsheet_id, body, service)
-        if error:
-            rows_with_errors.append([row["full name"], str(i + 2)])
-        sleep(1)
-        # n += 1
+        index = str(i + 2)
+        title = index + "_" + full_name
+        fields_hash = need_row_hash(full_name, number_of_guests, kosher, pets, mamad)
+        synced_row = None
+        if state is not None:
+            synced_row = get_synced_row(state, spreadsheet_id, index)
+            if synced_row and known_filter_views and synced_row[1] not in existing_filter_views:
+                # The filter view of the synced row was deleted in the spreadsheet, so send the row again
+                synced_row = None
+            if synced_row and synced_row[0] == fields_hash:
+                continue
+        if not synced_row and title in existing_filter_views:
+            # The filter view already exists, so there is no need to send it again
+            people_that_have_filter.append(title)
+            existing_rows.append([full_name, index])
+            existing_hashes.append(fields_hash)
+            existing_entries.append((title, [full_name, index], "exists", None))
+            continue
+        old_filter_view_id = None
+        if synced_row:
+            old_filter_view_id = existing_filter_views.get(synced_row[1], synced_row[2])
+        send_positions.append(position)
+        old_filter_view_ids.append(old_filter_view_id)
+        rows.append([full_name, index])
+        hashes.append(fields_hash)
+    bodies = create_filter_view_requests(need_house_df.iloc[send_positions], my_range)
+    for body, old_filter_view_id in zip(bodies, old_filter_view_ids):
+        if old_filter_view_id is not None:
+            # The row changed since the last run, so delete its old filter view before recreating it
+            body["requests"].insert(
+                0, {"deleteFilterView": {"filterId": old_filter_view_id}}
+            )
+    if checkpoint_journal is not None and existing_entries:
+        checkpoint_journal.record(spreadsheet_id, existing_entries)
+    rows_with_errors, sent_rows = update_spreadsheet_in_batches(
+        spreadsheet_id, bodies, rows, service, batch_size
+    )
+    update_existing_filter_views(
+        existing_filter_views, [index + "_" + full_name for full_name, index in rows]
+    )
+    if state is not None:
+        # Only the rows that were sent in this run are saved with their new hash
+        sent_indexes = {index for _, index in sent_rows}
+        sent_hashes = [
+            fields_hash for (_, index), fields_hash in zip(rows, hashes) if index in sent_indexes
+        ]
+        save_synced_rows(
+            state,
+            spreadsheet_id,
+            sent_rows + existing_rows,
+            sent_hashes + existing_hashes,
+            rows_with_errors,
+            existing_filter_views,
+        )
     return rows_with_errors
 
 
+def create_report_files(spreadsheet_id, rows_with_errors) -> None:
+    """
+    This function print the errors and create the txt files of the give houses spreadsheet.
+    In a checkpointed run they are rebuilt from the journal, so they cover the resumed runs too
+    :param spreadsheet_id:
+    :param rows_with_errors:
+    :return:
+    """
+    if checkpoint_journal is not None:
+        rows_with_errors = checkpoint_journal.get_rows_with_errors(spreadsheet_id)
+        have_filter = checkpoint_journal.get_people_that_have_filter(spreadsheet_id)
+    else:
+        have_filter = people_that_have_filter
+    print_info_about_errors(rows_with_errors)
+    create_txt_files(have_filter, rows_with_errors)
+
+
 def create_txt_files(people_that_have_filter, rows_with_errors) -> None:
     """
     This function create two txt files:
@@ -398,12 +1938,12 @@ def create_txt_files(people_that_have_filter, rows_with_errors) -> None:
     :return:
     """
     # write to text file the people that have filter:
-    with open("people_that_have_filter.txt", "w") as f:
+    with open(f"{report_files_prefix}people_that_have_filter.txt", "w") as f:
         for item in people_that_have_filter:
             f.write("%s\n" % item)
 
     # write to text file the people that have errors:
-    with open("people_that_have_errors.txt", "w") as f:
+    with open(f"{report_files_prefix}people_that_have_errors.txt", "w") as f:
         for item in rows_with_errors:
             f.write("%s\n" % item)
 
@@ -421,20 +1961,205 @@ def print_info_about_errors(rows_with_errors) -> None:
         print(f" {len(rows_with_errors)} errors occurred")
 
 
-def create_give_house_filters(need_house_df, give_spreadsheet_id, give_gsheet_id) -> None:
+def create_give_house_filters(
+    need_house_df, give_spreadsheet_id, give_gsheet_id, batch_size=1, state_db_path=None
+) -> None:
     """
     This function add the give houses filters to the spreadsheet
     :param need_house_df:
     :param give_spreadsheet_id:
     :param give_gsheet_id:
+    :param batch_size: number of addFilterView requests to send in one batchUpdate
+    :param state_db_path: path of the local state store for incremental sync, or None to send every row
     :return:
     """
     my_range, service = init_spreadsheet(give_spreadsheet_id, give_gsheet_id)
+    existing_filter_views = get_existing_filter_views(give_spreadsheet_id, service)
+    state = open_state_store(state_db_path) if state_db_path else None
     rows_with_errors = give_filters(
-        need_house_df, my_range, service, give_spreadsheet_id
+        need_house_df,
+        my_range,
+        service,
+        give_spreadsheet_id,
+        batch_size,
+        state,
+        existing_filter_views,
+    )
+    if state is not None:
+        state.close()
+    create_report_files(give_spreadsheet_id, rows_with_errors)
+
+
+def get_filter_views_details(spreadsheet_id, service) -> list:
+    """
+    This function return the filter views of the spreadsheet with their criteria and sort specs
+    :param spreadsheet_id:
+    :param service:
+    :return:
+    """
+    result = execute_with_retries(
+        service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id,
+            fields="sheets(filterViews(filterViewId,title,criteria,sortSpecs))",
+        )
     )
+    return [
+        filter_view
+        for sheet in result.get("sheets", [])
+        for filter_view in sheet.get("filterViews", [])
+    ]
+
+
+def normalize_criteria(criteria) -> dict:
+    """
+    This function normalize filter view criteria for comparison: the None criteria of
+    create_filter_view_request are dropped and the condition values are lists, like the API returns them
+    :param criteria:
+    :return:
+    """
+    normalized = {}
+    for column, criterion in criteria.items():
+        if criterion is None:
+            continue
+        criterion = dict(criterion)
+        if "condition" in criterion:
+            condition = dict(criterion["condition"])
+            values = condition.get("values", [])
+            condition["values"] = values if isinstance(values, list) else [values]
+            criterion["condition"] = condition
+        if "hiddenValues" in criterion:
+            criterion["hiddenValues"] = sorted(criterion["hiddenValues"])
+        normalized[str(column)] = criterion
+    return normalized
+
+
+def normalize_sort_specs(sort_specs) -> list:
+    """
+    This function normalize filter view sort specs for comparison, as (column, order) pairs in their order
+    :param sort_specs:
+    :return:
+    """
+    return [
+        (int(sort_spec.get("dimensionIndex", 0)), sort_spec.get("sortOrder", "ASCENDING"))
+        for sort_spec in sort_specs
+    ]
+
+
+def reconcile_filters(
+    need_house_df, my_range, service, spreadsheet_id, batch_size=1, state=None
+) -> dict:
+    """
+    This function diff the family filter views of the give houses spreadsheet against the active
+    need houses. Views of families that are no longer active (or duplicates of the same title) are deleted,
+    and views whose criteria or sort specs drifted from create_filter_view_request are updated, in batches.
+    Views that the script did not create (their title is not <row>_<full name>) are left alone
+    :param need_house_df: the need houses after clean_need_df
+    :param my_range:
+    :param service:
+    :param spreadsheet_id:
+    :param batch_size:
+    :param state: the state store from open_state_store, or None
+    :return: the number of deleted and updated filter views
+    """
+    from tqdm import tqdm
+
+    expected_filters = {}
+    for body in create_filter_view_requests(need_house_df, my_range):
+        expected_filter = body["requests"][0]["addFilterView"]["filter"]
+        expected_filters[expected_filter["title"]] = expected_filter
+
+    bodies = []
+    rows = []
+    deleted_titles = []
+    seen_titles = set()
+    for filter_view in get_filter_views_details(spreadsheet_id, service):
+        title = filter_view.get("title", "")
+        if not family_filter_view_title.match(title):
+            continue
+        expected_filter = expected_filters.get(title)
+        if expected_filter is None or title in seen_titles:
+            request = {"deleteFilterView": {"filterId": filter_view["filterViewId"]}}
+            deleted_titles.append(title)
+        elif normalize_criteria(filter_view.get("criteria", {})) != normalize_criteria(
+            expected_filter["criteria"]
+        ) or normalize_sort_specs(filter_view.get("sortSpecs", [])) != normalize_sort_specs(
+            expected_filter["sortSpecs"]
+        ):
+            request = {
+                "updateFilterView": {
+                    "filter": {
+                        "filterViewId": filter_view["filterViewId"],
+                        "criteria": {
+                            column: criterion
+                            for column, criterion in expected_filter["criteria"].items()
+                            if criterion is not None
+                        },
+                        "sortSpecs": expected_filter["sortSpecs"],
+                    },
+                    "fields": "criteria,sortSpecs",
+                }
+            }
+        else:
+            request = None
+        seen_titles.add(title)
+        if request is not None:
+            bodies.append({"requests": [request]})
+            rows.append([title, str(filter_view["filterViewId"])])
+
+    rows_with_errors = []
+    for start in tqdm(range(0, len(bodies), batch_size)):
+        rows_with_errors += update_spreadsheet_chunk(
+            spreadsheet_id,
+            bodies[start : start + batch_size],
+            rows[start : start + batch_size],
+            service,
+        )
     print_info_about_errors(rows_with_errors)
-    create_txt_files(people_that_have_filter, rows_with_errors)
+
+    existing_filter_views = filter_views_index.get(spreadsheet_id, {})
+    for title in deleted_titles:
+        existing_filter_views.pop(title, None)
+    # Forget the reconciled rows in the state store, so a family that comes back gets a new view
+    # and an updated view is saved again with the hash of its current fields
+    reconciled_titles = [
+        title
+        for title, filter_view_id in rows
+        if [title, filter_view_id] not in rows_with_errors
+    ]
+    if state is not None:
+        state.executemany(
+            "DELETE FROM filter_views WHERE spreadsheet_id = ? AND title = ?",
+            [(spreadsheet_id, title) for title in reconciled_titles],
+        )
+        state.commit()
+    return {
+        "deleted": len(deleted_titles),
+        "updated": len(bodies) - len(deleted_titles),
+        "errors": len(rows_with_errors),
+    }
+
+
+def reconcile_give_house_filters(
+    need_house_df, give_spreadsheet_id, give_gsheet_id, batch_size=1, state_db_path=None
+) -> None:
+    """
+    This function garbage collect the stale filter views of the give houses spreadsheet
+    and update the ones whose criteria or sort specs drifted
+    :param need_house_df:
+    :param give_spreadsheet_id:
+    :param give_gsheet_id:
+    :param batch_size:
+    :param state_db_path:
+    :return:
+    """
+    my_range, service = init_spreadsheet(give_spreadsheet_id, give_gsheet_id)
+    state = open_state_store(state_db_path) if state_db_path else None
+    result = reconcile_filters(
+        need_house_df, my_range, service, give_spreadsheet_id, batch_size, state
+    )
+    if state is not None:
+        state.close()
+    print(f"Reconcile: {result['deleted']} filter views deleted, {result['updated']} updated")
 
 
 def create_filter_view_request_treatment(my_range, treatment_name):
@@ -449,12 +2174,7 @@ def create_filter_view_request_treatment(my_range, treatment_name):
             "filter": {
                 "title": treatment_name,
                 "range": my_range,
-                "sortSpecs": [
-                    {
-                        "dimensionIndex": 0,  # I choose 0 because its the date column.
-                        "sortOrder": "ASCENDING",
-                    },
-                ],
+                "sortSpecs": date_sort_specs,
                 "criteria": {
                     "17": {
                         "condition": {
@@ -470,46 +2190,76 @@ def create_filter_view_request_treatment(my_range, treatment_name):
     return body
 
 
-def treatment_filters(need_house_df, my_range, service, need_spreadsheet_id) -> list:
+@timed_stage("treatment_filters")
+def treatment_filters(
+    need_house_df,
+    my_range,
+    service,
+    need_spreadsheet_id,
+    batch_size=1,
+    existing_filter_views=None,
+) -> list:
     """
     This function add filter views to the treatment column in the need houses spreadsheet
     :param need_house_df:
     :param my_range:
     :param service:
     :param need_spreadsheet_id:
+    :param batch_size: number of addFilterView requests to send in one batchUpdate
+    :param existing_filter_views: title -> filterViewId index from get_existing_filter_views
     :return:
     """
-    rows_with_errors = []
+    if existing_filter_views is None:
+        existing_filter_views = {}
     # Remove rows that need_house_df['treatment'] has '' in them
     need_house_df = need_house_df.loc[need_house_df["treatment"] != ""]
     treatment_people = need_house_df["treatment"].unique()
     need_house_df = need_house_df.loc[need_house_df["treatment"].isin(treatment_people)]
     # choose only one row for each treatment
     need_house_df = need_house_df.drop_duplicates(subset=["treatment"])
-    tqdm_need_houses = tqdm(need_house_df.iterrows())
-    n = 1
+    bodies = []
+    rows = []
     # iterate through the need houses
-    for i, row in tqdm_need_houses:
-        body = create_filter_view_request_treatment(my_range, row["treatment"])
-        error = update_spreadsheet(need_spreadsheet_id, body, service)
-        if error:
-            rows_with_errors.append([row["full name"], str(i + 2)])
-        sleep(1)
-        # n += 1
+    for i, full_name, treatment in zip(
+        need_house_df.index,
+        need_house_df["full name"].to_numpy(),
+        need_house_df["treatment"].to_numpy(),
+    ):
+        body = create_filter_view_request_treatment(my_range, treatment)
+        if get_filter_view_title(body) in existing_filter_views:
+            # The filter view already exists, so there is no need to send it again
+            continue
+        bodies.append(body)
+        rows.append([full_name, str(i + 2)])
+    rows_with_errors, _ = update_spreadsheet_in_batches(
+        need_spreadsheet_id, bodies, rows, service, batch_size
+    )
+    update_existing_filter_views(
+        existing_filter_views, [get_filter_view_title(body) for body in bodies]
+    )
     return rows_with_errors
 
 
-def create_treatment_filters(need_house_df, need_spreadsheet_id, need_gsheet_id) -> None:
+def create_treatment_filters(
+    need_house_df, need_spreadsheet_id, need_gsheet_id, batch_size=1
+) -> None:
     """
     This function add the treatment filters to the spreadsheet
     :param need_house_df:
     :param need_spreadsheet_id:
     :param need_gsheet_id:
+    :param batch_size: number of addFilterView requests to send in one batchUpdate
     :return:
     """
     my_range, service = init_spreadsheet(need_spreadsheet_id, need_gsheet_id)
+    existing_filter_views = get_existing_filter_views(need_spreadsheet_id, service)
     rows_with_errors = treatment_filters(
-        need_house_df, my_range, service, need_spreadsheet_id
+        need_house_df,
+        my_range,
+        service,
+        need_spreadsheet_id,
+        batch_size,
+        existing_filter_views,
     )
 
 
@@ -527,12 +2277,7 @@ def create_filter_view_request_type(my_range, request_type):
             "filter": {
                 "title": "-- " + request_type,
                 "range": my_range,
-                "sortSpecs": [
-                    {
-                        "dimensionIndex": 0,  # I choose 0 because its the date column.
-                        "sortOrder": "ASCENDING",
-                    },
-                ],
+                "sortSpecs": date_sort_specs,
                 "criteria": {
                     "20": {
                         "condition": {
@@ -548,69 +2293,877 @@ def create_filter_view_request_type(my_range, request_type):
     return body
 
 
-def request_type_filters(need_house_df, my_range, service, need_spreadsheet_id) -> list:
+@timed_stage("request_type_filters")
+def request_type_filters(
+    need_house_df,
+    my_range,
+    service,
+    need_spreadsheet_id,
+    batch_size=1,
+    existing_filter_views=None,
+) -> list:
     """
     This function add filter views to the request type column in the need houses spreadsheet
     :param need_house_df:
     :param my_range:
     :param service:
     :param need_spreadsheet_id:
+    :param batch_size: number of addFilterView requests to send in one batchUpdate
+    :param existing_filter_views: title -> filterViewId index from get_existing_filter_views
     :return:
     """
-    rows_with_errors = []
-    request_type = need_house_df["request status"].unique()
-    need_house_df = need_house_df.loc[
-        need_house_df["request status"].isin(request_type)
-    ]
-    # choose only one row for each treatment
-    need_house_df = need_house_df.drop_duplicates(subset=["request status"])
-    tqdm_need_houses = tqdm(need_house_df.iterrows())
-    n = 1
+    if existing_filter_views is None:
+        existing_filter_views = {}
+    # choose only one row for each request status, by the codes of the status categorical
+    statuses = need_house_df["request status"].astype("category")
+    need_house_df = need_house_df.loc[~statuses.cat.codes.duplicated().to_numpy()]
+    bodies = []
+    rows = []
     # iterate through the need houses
-    for i, row in tqdm_need_houses:
-        body = create_filter_view_request_type(my_range, row["request status"])
-        error = update_spreadsheet(need_spreadsheet_id, body, service)
-        if error:
-            rows_with_errors.append([row["full name"], str(i + 2)])
-        sleep(1)
-        # n += 1
+    for i, full_name, status in zip(
+        need_house_df.index,
+        need_house_df["full name"].to_numpy(),
+        need_house_df["request status"].to_numpy(),
+    ):
+        body = create_filter_view_request_type(my_range, status)
+        if get_filter_view_title(body) in existing_filter_views:
+            # The filter view already exists, so there is no need to send it again
+            continue
+        bodies.append(body)
+        rows.append([full_name, str(i + 2)])
+    rows_with_errors, _ = update_spreadsheet_in_batches(
+        need_spreadsheet_id, bodies, rows, service, batch_size
+    )
+    update_existing_filter_views(
+        existing_filter_views, [get_filter_view_title(body) for body in bodies]
+    )
     return rows_with_errors
 
 
-def create_request_type_filters(need_house_df, need_spreadsheet_id, need_gsheet_id) -> None:
+def create_request_type_filters(
+    need_house_df, need_spreadsheet_id, need_gsheet_id, batch_size=1
+) -> None:
     """
     This function add the request type filters to the spreadsheet
     :param need_house_df:
     :param need_spreadsheet_id:
     :param need_gsheet_id:
+    :param batch_size: number of addFilterView requests to send in one batchUpdate
     :return:
     """
     my_range, service = init_spreadsheet(need_spreadsheet_id, need_gsheet_id)
+    existing_filter_views = get_existing_filter_views(need_spreadsheet_id, service)
     rows_with_errors = request_type_filters(
-        need_house_df, my_range, service, need_spreadsheet_id
+        need_house_df,
+        my_range,
+        service,
+        need_spreadsheet_id,
+        batch_size,
+        existing_filter_views,
     )
 
 
-def main():
-    give_spreadsheet_id = ""
-    give_gsheet_id = 0
-    need_spreadsheet_id = ""
-    need_gsheet_id = 0
+def create_filters_concurrently(
+    need_house_df,
+    give_spreadsheet_id,
+    give_gsheet_id,
+    need_spreadsheet_id,
+    need_gsheet_id,
+    batch_size=1,
+    state_db_path=None,
+) -> None:
+    """
+    This function run the give houses, treatment and request type passes at the same time.
+    All the passes share the rate limiter, so the total run time is set by the quota
+    :param need_house_df:
+    :param give_spreadsheet_id:
+    :param give_gsheet_id:
+    :param need_spreadsheet_id:
+    :param need_gsheet_id:
+    :param batch_size:
+    :param state_db_path:
+    :return:
+    """
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        passes = [
+            executor.submit(
+                create_give_house_filters,
+                need_house_df,
+                give_spreadsheet_id,
+                give_gsheet_id,
+                batch_size,
+                state_db_path,
+            ),
+            executor.submit(
+                create_treatment_filters,
+                need_house_df,
+                need_spreadsheet_id,
+                need_gsheet_id,
+                batch_size,
+            ),
+            executor.submit(
+                create_request_type_filters,
+                need_house_df,
+                need_spreadsheet_id,
+                need_gsheet_id,
+                batch_size,
+            ),
+        ]
+        # Raise the exception of a pass that failed
+        for filters_pass in passes:
+            filters_pass.result()
+
+
+def create_filters_streaming(
+    need_house_blocks,
+    give_spreadsheet_id,
+    give_gsheet_id,
+    need_spreadsheet_id,
+    need_gsheet_id,
+    batch_size=1,
+    state_db_path=None,
+) -> None:
+    """
+    This function run the give houses, treatment and request type passes on every block of
+    need houses as it arrives from get_need_df_blocks. The filter views index of each spreadsheet
+    is shared by all the blocks, so a treatment or request type seen in an earlier block is not sent again
+    :param need_house_blocks:
+    :param give_spreadsheet_id:
+    :param give_gsheet_id:
+    :param need_spreadsheet_id:
+    :param need_gsheet_id:
+    :param batch_size:
+    :param state_db_path:
+    :return:
+    """
+    give_range, service = init_spreadsheet(give_spreadsheet_id, give_gsheet_id)
+    need_range, service = init_spreadsheet(need_spreadsheet_id, need_gsheet_id)
+    give_filter_views = get_existing_filter_views(give_spreadsheet_id, service)
+    need_filter_views = get_existing_filter_views(need_spreadsheet_id, service)
+    if need_filter_views is None:
+        # Still shared by the blocks, so a treatment or request type is sent once
+        need_filter_views = {}
+    state = open_state_store(state_db_path) if state_db_path else None
+    rows_with_errors = []
+    for need_house_df in need_house_blocks:
+        rows_with_errors += give_filters(
+            need_house_df,
+            give_range,
+            service,
+            give_spreadsheet_id,
+            batch_size,
+            state,
+            give_filter_views,
+        )
+        treatment_filters(
+            need_house_df,
+            need_range,
+            service,
+            need_spreadsheet_id,
+            batch_size,
+            need_filter_views,
+        )
+        request_type_filters(
+            need_house_df,
+            need_range,
+            service,
+            need_spreadsheet_id,
+            batch_size,
+            need_filter_views,
+        )
+    if state is not None:
+        state.close()
+    create_report_files(give_spreadsheet_id, rows_with_errors)
+
+def get_sheet_timestamps(
+    spreadsheet_id, sheet_range=need_sheet_range, column=need_timestamp_column
+) -> list:
+    """
+    This function read only the timestamp column of the sheet, from the header row down.
+    It is one small read, so the watch mode can poll it often
+    :param spreadsheet_id:
+    :param sheet_range:
+    :param column:
+    :return: the timestamps, with "" for the empty cells
+    """
+    letter = column_letter(column)
+    result = execute_with_retries(
+        get_service()
+        .spreadsheets()
+        .values()
+        .get(
+            spreadsheetId=spreadsheet_id,
+            range=f"'{sheet_range}'!{letter}2:{letter}",
+            fields="values",
+        )
+    )
+    return [row[0] if row else "" for row in result.get("values", [])]
+
+
+def get_timestamps_hash(timestamps) -> str:
+    """
+    This function return the hash of the timestamp column, to compare polls without keeping the column
+    :param timestamps:
+    :return:
+    """
+    return hashlib.sha256("\n".join(timestamps).encode("utf-8")).hexdigest()
+
+
+def get_need_df(need_spreadsheet_id, start_row=2, row_count=None, header_row=None):
+    """
+    This function read the used columns of the need houses sheet, from start_row, and clean them
+    :param need_spreadsheet_id:
+    :param start_row:
+    :param row_count:
+    :param header_row:
+    :return:
+    """
+    need_house_df = get_df_columns(
+        need_spreadsheet_id,
+        list(need_columns_rename),
+        need_sheet_range,
+        start_row,
+        row_count,
+        blank_as_missing=need_blank_as_missing,
+        header_row=header_row,
+    )
+    return clean_need_df(need_house_df)
+
+
+def watch_filters(
+    give_spreadsheet_id,
+    give_gsheet_id,
+    need_spreadsheet_id,
+    need_gsheet_id,
+    batch_size=1,
+    state_db_path=None,
+    poll_interval=10,
+    max_poll_interval=300,
+    backoff_factor=2,
+    report_path=None,
+    max_polls=None,
+    dedup_mode=None,
+) -> pd.DataFrame:
+    """
+    This function keep the filter views in sync with the need houses sheet as the form fills it.
+    After one full pass it polls only the timestamp column. When rows were appended, only the new
+    rows are read and sent through the passes; when older rows changed or were removed the sheet
+    is read again and the state store and the filter views index skip what is already synced.
+    The cleaned need houses dataframe stays in memory between the polls
+    :param give_spreadsheet_id:
+    :param give_gsheet_id:
+    :param need_spreadsheet_id:
+    :param need_gsheet_id:
+    :param batch_size:
+    :param state_db_path:
+    :param poll_interval: seconds between two polls
+    :param max_poll_interval: the longest wait between two polls after failed polls
+    :param backoff_factor: the poll interval is multiplied by it after every failed poll
+    :param report_path: where to write the run report after every change, None skips it
+    :param max_polls: stop after this many polls, None watches forever
+    :param dedup_mode: "collapse" or "flag" the repeated submissions with dedup_need_df, None keeps them.
+    The new rows of a poll are compared with all the rows read before
+    :return: the cleaned need houses dataframe of the last poll
+    """
+    import httplib2
+
+    # The timestamps are read before the rows, so rows that arrive in between are read twice, never missed
+    timestamps = get_sheet_timestamps(need_spreadsheet_id)
+    header_row = get_header_row(need_spreadsheet_id, need_sheet_range)
+    need_house_df = get_need_df(need_spreadsheet_id, header_row=header_row)
+    duplicate_finder = DuplicateFinder()
+    if dedup_mode:
+        need_house_df = dedup_need_df(need_house_df, dedup_mode, duplicate_finder)
+    create_filters_concurrently(
+        need_house_df,
+        give_spreadsheet_id,
+        give_gsheet_id,
+        need_spreadsheet_id,
+        need_gsheet_id,
+        batch_size,
+        state_db_path,
+    )
+    rows_number, timestamps_hash = len(timestamps), get_timestamps_hash(timestamps)
+    interval = poll_interval
+    polls = 0
+    while max_polls is None or polls < max_polls:
+        sleep(interval)
+        polls += 1
+        try:
+            timestamps = get_sheet_timestamps(need_spreadsheet_id)
+            if (
+                len(timestamps) == rows_number
+                and get_timestamps_hash(timestamps) == timestamps_hash
+            ):
+                interval = poll_interval
+                continue
+            if (
+                len(timestamps) > rows_number
+                and get_timestamps_hash(timestamps[:rows_number]) == timestamps_hash
+            ):
+                logger.info(f"{len(timestamps) - rows_number} new rows in the need sheet")
+                new_need_house_df = get_need_df(
+                    need_spreadsheet_id,
+                    rows_number + 2,
+                    len(timestamps) - rows_number,
+                    header_row,
+                )
+                if dedup_mode:
+                    new_need_house_df = dedup_need_df(
+                        new_need_house_df, dedup_mode, duplicate_finder
+                    )
+                need_house_df = pd.concat(
+                    [
+                        need_house_df[~need_house_df.index.isin(new_need_house_df.index)],
+                        new_need_house_df,
+                    ]
+                )
+            else:
+                logger.info("Rows of the need sheet changed, reading it again")
+                header_row = get_header_row(need_spreadsheet_id, need_sheet_range)
+                need_house_df = new_need_house_df = get_need_df(
+                    need_spreadsheet_id, header_row=header_row
+                )
+                duplicate_finder = DuplicateFinder()
+                if dedup_mode:
+                    need_house_df = new_need_house_df = dedup_need_df(
+                        need_house_df, dedup_mode, duplicate_finder
+                    )
+            if not new_need_house_df.empty:
+                create_filters_concurrently(
+                    new_need_house_df,
+                    give_spreadsheet_id,
+                    give_gsheet_id,
+                    need_spreadsheet_id,
+                    need_gsheet_id,
+                    batch_size,
+                    state_db_path,
+                )
+        except (HttpError, OSError, httplib2.HttpLib2Error) as error:
+            # API errors, dropped connections and timeouts: the change is picked up again by the next poll
+            interval = min(max_poll_interval, interval * backoff_factor)
+            logger.warning(f"Poll failed: {error}, next poll in {interval} seconds")
+            continue
+        rows_number, timestamps_hash = len(timestamps), get_timestamps_hash(timestamps)
+        interval = poll_interval
+        if report_path:
+            write_run_report(report_path)
+    return need_house_df
 
+
+def write_run_report(report_path, metrics_path=None) -> None:
+    """
+    This function write the run metrics to a JSON report and, optionally, in the Prometheus text format
+    :param report_path:
+    :param metrics_path:
+    :return:
+    """
+    with open(report_path, "w") as f:
+        json.dump(run_metrics.to_dict(), f, indent=1, ensure_ascii=False)
+    if metrics_path:
+        with open(metrics_path, "w") as f:
+            f.write(run_metrics.to_prometheus())
+
+
+def create_filters(
+    give_spreadsheet_id,
+    give_gsheet_id,
+    need_spreadsheet_id,
+    need_gsheet_id,
+    batch_size=1,
+    state_db_path=None,
+    reconcile=False,
+    dedup_mode=None,
+) -> None:
+    """
+    This function read and clean the need houses sheet and create all the filter views of one
+    pair of need and give spreadsheets
+    :param give_spreadsheet_id:
+    :param give_gsheet_id:
+    :param need_spreadsheet_id:
+    :param need_gsheet_id:
+    :param batch_size:
+    :param state_db_path:
+    :param reconcile: delete and update the stale filter views of the give spreadsheet first
+    :param dedup_mode: "collapse" or "flag" the repeated submissions with dedup_need_df, None keeps them
+    :return:
+    """
     need_house_df = get_df_from_google_sheet(
         "need_df",
         give_spreadsheet_id=give_spreadsheet_id,
         need_spreadsheet_id=need_spreadsheet_id,
+        only_used_columns=True,
     )
     need_house_df = clean_need_df(need_house_df)
+    if dedup_mode:
+        need_house_df = dedup_need_df(need_house_df, dedup_mode)
+
+    if reconcile:
+        reconcile_give_house_filters(
+            need_house_df,
+            give_spreadsheet_id,
+            give_gsheet_id,
+            batch_size,
+            state_db_path,
+        )
+    create_filters_concurrently(
+        need_house_df,
+        give_spreadsheet_id,
+        give_gsheet_id,
+        need_spreadsheet_id,
+        need_gsheet_id,
+        batch_size,
+        state_db_path,
+    )
+
+
+@timed_stage("plan")
+def create_plan(
+    need_house_df,
+    give_spreadsheet_id,
+    give_gsheet_id,
+    need_spreadsheet_id,
+    need_gsheet_id,
+) -> list:
+    """
+    This function build, without any API call, the addFilterView operations that the give houses,
+    treatment and request type passes would send, in this order and without repeated titles.
+    The families are in the order of get_send_order, like in give_filters
+    :param need_house_df: the cleaned need houses
+    :param give_spreadsheet_id:
+    :param give_gsheet_id:
+    :param need_spreadsheet_id:
+    :param need_gsheet_id:
+    :return: operations with the spreadsheet, the pass, the title, the row and the request
+    """
+    need_house_df = need_house_df.iloc[get_send_order(need_house_df)]
+    give_range = get_my_range(give_gsheet_id)
+    need_range = get_my_range(need_gsheet_id)
+    rows = [
+        [full_name, str(i + 2)]
+        for i, full_name in zip(need_house_df.index, need_house_df["full name"].to_numpy())
+    ]
+    passes = [
+        (
+            give_spreadsheet_id,
+            "give",
+            create_filter_view_requests(need_house_df, give_range),
+            rows,
+        )
+    ]
+    treatment_rows = need_house_df.loc[need_house_df["treatment"] != ""]
+    treatment_rows = treatment_rows.drop_duplicates(subset=["treatment"])
+    passes.append(
+        (
+            need_spreadsheet_id,
+            "treatment",
+            [
+                create_filter_view_request_treatment(need_range, treatment)
+                for treatment in treatment_rows["treatment"].to_numpy()
+            ],
+            [rows[need_house_df.index.get_loc(i)] for i in treatment_rows.index],
+        )
+    )
+    statuses = need_house_df["request status"].astype("category")
+    status_rows = need_house_df.loc[~statuses.cat.codes.duplicated().to_numpy()]
+    passes.append(
+        (
+            need_spreadsheet_id,
+            "request type",
+            [
+                create_filter_view_request_type(need_range, status)
+                for status in status_rows["request status"].to_numpy()
+            ],
+            [rows[need_house_df.index.get_loc(i)] for i in status_rows.index],
+        )
+    )
+
+    plan = []
+    titles = set()
+    for spreadsheet_id, filters_pass, bodies, pass_rows in passes:
+        for body, row in zip(bodies, pass_rows):
+            title = get_filter_view_title(body)
+            if (spreadsheet_id, title) in titles:
+                continue
+            titles.add((spreadsheet_id, title))
+            plan.append(
+                {
+                    "spreadsheet_id": spreadsheet_id,
+                    "pass": filters_pass,
+                    "title": title,
+                    "row": row,
+                    "request": body["requests"][0],
+                }
+            )
+    return plan
+
+
+def write_plan(plan, plan_path) -> None:
+    """
+    This function write the plan as JSONL, one operation per line, so two plans can be diffed
+    :param plan:
+    :param plan_path:
+    :return:
+    """
+    with open(plan_path, "w", encoding="utf-8") as f:
+        for operation in plan:
+            f.write(json.dumps(operation, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+def read_plan(plan_path) -> list:
+    """
+    This function read a plan written by write_plan
+    :param plan_path:
+    :return:
+    """
+    with open(plan_path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def apply_plan(plan, batch_size=1) -> None:
+    """
+    This function send the operations of a plan, batch_size operations in one batchUpdate.
+    The operations whose title already exists in the spreadsheet are skipped, so a plan can be applied again
+    :param plan:
+    :param batch_size:
+    :return:
+    """
+    service = get_service()
+    operations_by_spreadsheet = defaultdict(list)
+    for operation in plan:
+        operations_by_spreadsheet[operation["spreadsheet_id"]].append(operation)
+    for spreadsheet_id, operations in operations_by_spreadsheet.items():
+        existing_filter_views = get_existing_filter_views(spreadsheet_id, service)
+        if existing_filter_views is None:
+            existing_filter_views = {}
+        bodies = []
+        rows = []
+        existing_entries = []
+        for operation in operations:
+            if operation["title"] in existing_filter_views:
+                if operation["pass"] == "give":
+                    people_that_have_filter.append(operation["title"])
+                    existing_entries.append(
+                        (operation["title"], operation["row"], "exists", None)
+                    )
+                continue
+            bodies.append({"requests": [operation["request"]]})
+            rows.append(operation["row"])
+        if checkpoint_journal is not None and existing_entries:
+            checkpoint_journal.record(spreadsheet_id, existing_entries)
+        rows_with_errors, _ = update_spreadsheet_in_batches(
+            spreadsheet_id, bodies, rows, service, batch_size
+        )
+        update_existing_filter_views(
+            existing_filter_views, [get_filter_view_title(body) for body in bodies]
+        )
+        if any(operation["pass"] == "give" for operation in operations):
+            create_report_files(spreadsheet_id, rows_with_errors)
+
+
+def get_shard_path(name, path) -> str:
+    """
+    This function return the path of a shard file, the file name prefixed with the shard name
+    in the same directory, so "runs/journal.jsonl" of the shard north is "runs/north_journal.jsonl"
+    :param name:
+    :param path:
+    :return:
+    """
+    return os.path.join(os.path.dirname(path), f"{name}_{os.path.basename(path)}")
+
+
+def run_shard(
+    shard,
+    requests_per_minute,
+    batch_size=1,
+    state_db_path=None,
+    checkpoint_path=None,
+    resume=False,
+    reconcile=False,
+    dedup_mode=None,
+) -> dict:
+    """
+    This function create the filter views of one shard in a worker process of create_filters_sharded.
+    The shard gets its own service, rate limiter and metrics, and its own state store, journal and
+    txt files, prefixed with its name
+    :param shard: dict with name, give_spreadsheet_id, give_gsheet_id, need_spreadsheet_id and need_gsheet_id
+    :param requests_per_minute: the share of the quota of this shard
+    :param batch_size:
+    :param state_db_path:
+    :param checkpoint_path:
+    :param resume:
+    :param reconcile:
+    :param dedup_mode:
+    :return: the people that have filter, the rows with errors and the metrics of the shard
+    """
+    global sheets_credentials, sheets_service, thread_local_http, rate_limiter
+    global run_metrics, checkpoint_journal, report_files_prefix
+    # A worker process runs one shard after the other, and a forked one starts with a copy of the parent state
+    people_that_have_filter.clear()
+    created_filter_views.clear()
+    filter_views_index.clear()
+    sheets_credentials = None
+    sheets_service = None
+    thread_local_http = threading.local()
+    rate_limiter = AdaptiveRateLimiter(
+        requests_per_minute,
+        max_requests_per_minute=requests_per_minute
+        * sheets_max_requests_per_minute
+        / sheets_requests_per_minute,
+    )
+    run_metrics = RunMetrics()
+    name = shard["name"]
+    report_files_prefix = f"{name}_"
+    checkpoint_journal = CheckpointJournal(get_shard_path(name, checkpoint_path), resume)
+    create_filters(
+        shard["give_spreadsheet_id"],
+        shard.get("give_gsheet_id", 0),
+        shard["need_spreadsheet_id"],
+        shard.get("need_gsheet_id", 0),
+        batch_size,
+        get_shard_path(name, state_db_path) if state_db_path else None,
+        reconcile,
+        dedup_mode,
+    )
+    checkpoint_journal.close()
+    return {
+        "people that have filter": checkpoint_journal.get_people_that_have_filter(
+            shard["give_spreadsheet_id"]
+        ),
+        "rows with errors": checkpoint_journal.get_rows_with_errors(
+            shard["give_spreadsheet_id"]
+        ),
+        "metrics": run_metrics.to_dict(),
+    }
+
+
+def create_filters_sharded(
+    shards_path,
+    processes=None,
+    batch_size=1,
+    state_db_path=None,
+    checkpoint_path=None,
+    resume=False,
+    reconcile=False,
+    dedup_mode=None,
+) -> None:
+    """
+    This function create the filter views of many pairs of need and give spreadsheets, for example
+    one pair per region, in a pool of processes. The per-user quota is split between the processes,
+    and the txt files and the metrics of all the shards are combined
+    :param shards_path: JSON file with a list of shards, see run_shard
+    :param processes: the number of worker processes, None runs every shard in its own process
+    :param batch_size:
+    :param state_db_path:
+    :param checkpoint_path:
+    :param resume:
+    :param reconcile:
+    :param dedup_mode:
+    :return:
+    """
+    with open(shards_path) as f:
+        shards = json.load(f)
+    processes = min(processes or len(shards), len(shards))
+    # Log in once here, so the workers find token.json and never start the authorization flow
+    get_credentials()
+    have_filter = []
+    rows_with_errors = []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = {
+            shard["name"]: executor.submit(
+                run_shard,
+                shard,
+                sheets_requests_per_minute / processes,
+                batch_size,
+                state_db_path,
+                checkpoint_path,
+                resume,
+                reconcile,
+                dedup_mode,
+            )
+            for shard in shards
+        }
+        for name, result in results.items():
+            try:
+                shard_result = result.result()
+            except Exception as error:
+                print(f"Shard {name} failed: {error}")
+                run_metrics.record_error("shard")
+                continue
+            have_filter += [f"{name}: {title}" for title in shard_result["people that have filter"]]
+            rows_with_errors += [f"{name}: {row}" for row in shard_result["rows with errors"]]
+            run_metrics.merge(shard_result["metrics"])
+    print_info_about_errors(rows_with_errors)
+    create_txt_files(have_filter, rows_with_errors)
+
 
-    create_give_house_filters(need_house_df, give_spreadsheet_id, give_gsheet_id)
-    create_treatment_filters(need_house_df, need_spreadsheet_id, need_gsheet_id)
-    create_request_type_filters(need_house_df, need_spreadsheet_id, need_gsheet_id)
+def main(
+    resume=False,
+    reconcile=False,
+    watch=False,
+    shards_path=None,
+    offline=False,
+    plan_path=None,
+    apply_path=None,
+):
+    give_spreadsheet_id = ""
+    give_gsheet_id = 0
+    need_spreadsheet_id = ""
+    need_gsheet_id = 0
+    # number of addFilterView requests in one batchUpdate, 1 sends every row on its own
+    batch_size = 100
+    # local state store of the rows that already have a filter view, None sends every row
+    state_db_path = "filter_views_state.sqlite"
+    # read and process the need sheet in blocks of this many rows, None reads it all at once
+    stream_block_size = None
+    # logging.DEBUG also prints every API response
+    log_level = logging.INFO
+    # where to write the JSON run report and the Prometheus metrics, None skips the metrics
+    report_path = "run_report.json"
+    metrics_path = None
+    # journal of the sent requests, so a killed run can continue with --resume
+    checkpoint_path = "checkpoint_journal.jsonl"
+    # seconds between two polls of the need sheet in watch mode, and the backoff after failed polls
+    watch_poll_interval = 10
+    watch_max_poll_interval = 300
+    watch_backoff_factor = 2
+    # directory of the local snapshots of the sheets and the seconds they are used before
+    # the sheets are fetched again, None fetches the sheets on every run
+    snapshot_dir = "snapshots"
+    snapshot_ttl = None
+    # worker processes of --shards, None runs every shard in its own process
+    shard_processes = None
+    # "collapse" drops the repeated form submissions of a family, "flag" marks them, None keeps them
+    dedup_mode = "collapse"
+
+    logging.basicConfig(level=log_level)
+    global snapshot_store
+    if snapshot_ttl is not None or offline:
+        snapshot_store = SnapshotStore(snapshot_dir, snapshot_ttl, offline)
+    if plan_path:
+        need_house_df = get_df_from_google_sheet(
+            "need_df",
+            need_spreadsheet_id=need_spreadsheet_id,
+            only_used_columns=True,
+        )
+        need_house_df = clean_need_df(need_house_df)
+        if dedup_mode:
+            need_house_df = dedup_need_df(need_house_df, dedup_mode)
+        plan = create_plan(
+            need_house_df,
+            give_spreadsheet_id,
+            give_gsheet_id,
+            need_spreadsheet_id,
+            need_gsheet_id,
+        )
+        write_plan(plan, plan_path)
+        print(f"{len(plan)} operations written to {plan_path}")
+        return
+    if shards_path:
+        create_filters_sharded(
+            shards_path,
+            shard_processes,
+            batch_size,
+            state_db_path,
+            checkpoint_path,
+            resume,
+            reconcile,
+            dedup_mode,
+        )
+        write_run_report(report_path, metrics_path)
+        print(f"Done!")
+        return
+    global checkpoint_journal
+    checkpoint_journal = CheckpointJournal(checkpoint_path, resume)
+    if apply_path:
+        apply_plan(read_plan(apply_path), batch_size)
+    elif watch:
+        watch_filters(
+            give_spreadsheet_id,
+            give_gsheet_id,
+            need_spreadsheet_id,
+            need_gsheet_id,
+            batch_size,
+            state_db_path,
+            watch_poll_interval,
+            watch_max_poll_interval,
+            watch_backoff_factor,
+            report_path,
+            dedup_mode=dedup_mode,
+        )
+    elif stream_block_size:
+        create_filters_streaming(
+            get_need_df_blocks(need_spreadsheet_id, stream_block_size, dedup_mode),
+            give_spreadsheet_id,
+            give_gsheet_id,
+            need_spreadsheet_id,
+            need_gsheet_id,
+            batch_size,
+            state_db_path,
+        )
+    else:
+        create_filters(
+            give_spreadsheet_id,
+            give_gsheet_id,
+            need_spreadsheet_id,
+            need_gsheet_id,
+            batch_size,
+            state_db_path,
+            reconcile,
+            dedup_mode,
+        )
 
+    checkpoint_journal.close()
+    write_run_report(report_path, metrics_path)
     print(f"Done!")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the previous run from its checkpoint journal",
+    )
+    parser.add_argument(
+        "--reconcile",
+        action="store_true",
+        help="delete the filter views of families that are no longer active and update "
+        "the ones whose criteria drifted, before creating the new ones "
+        "(not with stream_block_size, which never sees all the active families)",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and create the filter views of new families as they submit the form",
+    )
+    parser.add_argument(
+        "--shards",
+        help="JSON file with a list of need and give spreadsheet pairs to process in parallel, "
+        'like [{"name": "north", "need_spreadsheet_id": "...", "need_gsheet_id": 0, '
+        '"give_spreadsheet_id": "...", "give_gsheet_id": 0}]',
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="read the sheets only from their local snapshots, whatever their age",
+    )
+    parser.add_argument(
+        "--plan",
+        help="write the filter view operations that a run would send to this JSONL file, "
+        "without sending them",
+    )
+    parser.add_argument(
+        "--apply", help="send the filter view operations of a plan file written by --plan"
+    )
+    args = parser.parse_args()
+    main(
+        resume=args.resume,
+        reconcile=args.reconcile,
+        watch=args.watch,
+        shards_path=args.shards,
+        offline=args.offline,
+        plan_path=args.plan,
+        apply_path=args.apply,
+    )
 
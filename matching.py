@@ -0,0 +1,609 @@
+"""
+Local matching between the need houses and the give houses.
+The rules are the same as the filter views of create_filter_view_request and apply_filter,
+but every family gets its ranked host candidates at once, without opening a filter view per family.
+"""
+from bisect import bisect_left, insort
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from main import (
+    Answer,
+    clean_need_df,
+    get_df_from_google_sheet,
+    get_typed_need_df,
+    give_hidden_statuses,
+    number_of_guests_column,
+    kosher_column,
+)
+
+# The columns of the give houses spreadsheet that the filter views filter on
+give_guests_column = int(number_of_guests_column)
+give_kosher_column = int(kosher_column)
+give_not_kosher_column = 12
+give_pets_column = 15
+give_mamad_column = 16
+give_status_column = 22
+
+# Number of families that are matched against all the hosts at once
+families_block_size = 1024
+
+# The filters of a host, or the filters that a family needs, as the bits of a profile code
+profile_filters = ["kosher", "not kosher", "pets", "mamad"]
+profiles_number = 2 ** len(profile_filters)
+
+
+def give_column(give_house_df, column) -> pd.Series:
+    """
+    This function return a column of the give houses by its position, as strings without nan
+    :param give_house_df:
+    :param column:
+    :return:
+    """
+    if column >= give_house_df.shape[1]:
+        return pd.Series("", index=give_house_df.index)
+    return give_house_df.iloc[:, column].fillna("").astype(str)
+
+
+def get_typed_give_df(give_house_df, header_row_number=2) -> pd.DataFrame:
+    """
+    This function convert the give houses to a compact typed struct of arrays: integer number of guests,
+    a boolean column for every filter that the host passes, and categoricals for the kosher text
+    (the second sort key of the filter views) and the status
+    :param give_house_df:
+    :param header_row_number: the row of the headers in the give houses tab, index 0 of give_house_df
+    :return:
+    """
+    status = give_column(give_house_df, give_status_column)
+    return pd.DataFrame(
+        {
+            "give row": (give_house_df.index + header_row_number).astype(np.int32),
+            "number of guests": np.ceil(
+                pd.to_numeric(
+                    give_column(give_house_df, give_guests_column), errors="coerce"
+                )
+            ).astype("Int32"),
+            "kosher text": give_column(give_house_df, give_kosher_column).astype(
+                "category"
+            ),
+            "kosher": ~give_column(give_house_df, give_kosher_column).str.contains(
+                "לא", regex=False
+            ),
+            "not kosher": give_column(give_house_df, give_not_kosher_column) == "לא",
+            "pets": ~give_column(give_house_df, give_pets_column).str.contains(
+                "לא", regex=False
+            ),
+            "mamad": ~give_column(give_house_df, give_mamad_column).str.contains(
+                "לא", regex=False
+            ),
+            "status": status.astype("category"),
+            "available": ~status.isin(give_hidden_statuses),
+        },
+        index=give_house_df.index,
+    )
+
+
+def get_hosts_arrays(give_house_df, header_row_number=2) -> dict:
+    """
+    This function convert the give houses to NumPy arrays, sorted like the filter view sortSpecs
+    (number of guests and then kosher). Only the hosts that are not hidden by their status are kept
+    :param give_house_df:
+    :param header_row_number: the row of the headers in the give houses tab
+    :return:
+    """
+    hosts = get_typed_give_df(give_house_df, header_row_number)
+    hosts = hosts[hosts["available"] & hosts["number of guests"].notna()]
+    hosts = hosts.sort_values(["number of guests", "kosher text"], kind="stable")
+    arrays = {
+        column: hosts[column].to_numpy()
+        for column in ["give row", "kosher", "not kosher", "pets", "mamad"]
+    }
+    arrays["number of guests"] = hosts["number of guests"].to_numpy(dtype=np.int32)
+    return arrays
+
+
+def get_families_arrays(need_house_df) -> dict:
+    """
+    This function convert the cleaned need houses to NumPy arrays of the filters that each family needs
+    :param need_house_df:
+    :return:
+    """
+    typed_need_df = get_typed_need_df(need_house_df)
+    return {
+        "need row": typed_need_df.index.to_numpy() + 2,
+        "full name": typed_need_df["full name"].to_numpy(),
+        # A family without a number of guests gets no candidates, like a filter view without a number
+        "number of guests": typed_need_df["number of guests"].to_numpy(
+            dtype=np.int32, na_value=np.iinfo(np.int32).max
+        ),
+        "kosher": typed_need_df["kosher"].to_numpy() == Answer.YES,
+        "not kosher": typed_need_df["kosher"].to_numpy() == Answer.NO,
+        "pets": typed_need_df["pets"].to_numpy() == Answer.YES,
+        "mamad": typed_need_df["mamad"].to_numpy() == Answer.YES,
+    }
+
+
+def families_hosts_mask(families, hosts, start, stop) -> np.ndarray:
+    """
+    This function return a (families x hosts) boolean mask of the hosts that each family can see
+    in its filter view, for the families between start and stop
+    :param families:
+    :param hosts:
+    :param start:
+    :param stop:
+    :return:
+    """
+    block = slice(start, stop)
+    mask = hosts["number of guests"][None, :] >= families["number of guests"][block, None]
+    for column in ["kosher", "not kosher", "pets", "mamad"]:
+        mask &= ~families[column][block, None] | hosts[column][None, :]
+    return mask
+
+
+def match_families_to_hosts(
+    need_house_df, give_house_df, max_candidates=None, header_row_number=2
+) -> pd.DataFrame:
+    """
+    This function return the ranked host candidates of every family, one row per (family, host).
+    The rank is the order of the hosts in the family filter view
+    :param need_house_df: the need houses after clean_need_df
+    :param give_house_df: the give houses as returned by get_df
+    :param max_candidates: maximum number of candidates per family, or None for all of them
+    :param header_row_number: the row of the headers in the give houses tab
+    :return:
+    """
+    families = get_families_arrays(need_house_df)
+    hosts = get_hosts_arrays(give_house_df, header_row_number)
+    matches = []
+    for start in range(0, len(families["need row"]), families_block_size):
+        stop = start + families_block_size
+        mask = families_hosts_mask(families, hosts, start, stop)
+        # np.nonzero returns the hosts of each family in the sorted hosts order
+        family_positions, host_positions = np.nonzero(mask)
+        candidates_count = mask.sum(axis=1)
+        first_candidate = np.cumsum(candidates_count) - candidates_count
+        ranks = np.arange(len(family_positions)) - np.repeat(
+            first_candidate, candidates_count
+        )
+        family_positions = family_positions + start
+        matches.append(
+            pd.DataFrame(
+                {
+                    "need row": families["need row"][family_positions],
+                    "full name": families["full name"][family_positions],
+                    "rank": ranks + 1,
+                    "give row": hosts["give row"][host_positions],
+                    "number of guests": hosts["number of guests"][host_positions],
+                }
+            )
+        )
+    if not matches:
+        return pd.DataFrame(
+            columns=["need row", "full name", "rank", "give row", "number of guests"]
+        )
+    matches = pd.concat(matches, ignore_index=True)
+    if max_candidates is not None:
+        matches = matches[matches["rank"] <= max_candidates]
+    return matches
+
+
+def get_profile_codes(arrays) -> np.ndarray:
+    """
+    This function return the profile code of every host, or of every family, from its filter columns.
+    A host can get a family when the bits of the family code are all set in the host code
+    :param arrays: the result of get_hosts_arrays or get_families_arrays
+    :return:
+    """
+    codes = np.zeros(len(arrays["number of guests"]), dtype=np.int8)
+    for bit, column in enumerate(profile_filters):
+        codes |= arrays[column].astype(np.int8) << bit
+    return codes
+
+
+class FreeHosts:
+    """
+    The hosts of every profile that are not assigned yet, sorted like the filter view sortSpecs,
+    so the smallest host with enough beds for a family is a binary search in each profile
+    """
+
+    def __init__(self, hosts, host_profiles):
+        self.capacities = [[] for _ in range(profiles_number)]
+        self.positions = [[] for _ in range(profiles_number)]
+        # The hosts are already sorted, so every profile list is sorted too
+        for position, (capacity, profile) in enumerate(
+            zip(hosts["number of guests"].tolist(), host_profiles.tolist())
+        ):
+            self.capacities[profile].append(capacity)
+            self.positions[profile].append(position)
+
+    def find(self, profiles, number_of_guests):
+        """
+        Return (host position, profile, index) of the first free host in the filter view order
+        that has enough beds, among the given profiles, or None
+        """
+        best = None
+        for profile in profiles:
+            capacities = self.capacities[profile]
+            i = bisect_left(capacities, number_of_guests)
+            if i < len(capacities):
+                position = self.positions[profile][i]
+                if best is None or position < best[0]:
+                    best = (position, profile, i)
+        return best
+
+    def take(self, profile, i) -> None:
+        del self.capacities[profile][i]
+        del self.positions[profile][i]
+
+
+def assign_families_to_hosts(
+    need_house_df, give_house_df, max_swap_candidates=32, header_row_number=2
+) -> tuple:
+    """
+    This function propose one host for every family, and every host to at most one family,
+    with the rules of the filter views.
+    The families with the fewest candidate hosts are assigned first, each to the smallest host with
+    enough beds (best fit), so large homes are kept for large families. Then every family that is
+    left without a host tries to take the host of an assigned family that can move to a free host.
+    The candidates are never listed: the hosts are grouped by their filters profile and sorted by
+    capacity, so finding a host is a binary search in each of the profiles
+    :param need_house_df: the need houses after clean_need_df
+    :param give_house_df: the give houses as returned by get_df
+    :param max_swap_candidates: assigned hosts to try for each family that is left without a host
+    :param header_row_number: the row of the headers in the give houses tab
+    :return: the assignments and the unmatched families
+    """
+    families = get_families_arrays(need_house_df)
+    hosts = get_hosts_arrays(give_house_df, header_row_number)
+    family_profiles = get_profile_codes(families)
+    host_profiles = get_profile_codes(hosts)
+    family_guests = families["number of guests"]
+    compatible_profiles = [
+        [
+            profile
+            for profile in range(profiles_number)
+            if profile & family_profile == family_profile
+        ]
+        for family_profile in range(profiles_number)
+    ]
+
+    # Number of hosts that each family can see in its filter view
+    candidates_count = np.zeros(len(family_guests), dtype=np.int64)
+    for family_profile in np.unique(family_profiles):
+        families_of_profile = family_profiles == family_profile
+        for profile in compatible_profiles[family_profile]:
+            capacities = np.sort(hosts["number of guests"][host_profiles == profile])
+            candidates_count[families_of_profile] += len(capacities) - np.searchsorted(
+                capacities, family_guests[families_of_profile]
+            )
+
+    free_hosts = FreeHosts(hosts, host_profiles)
+    host_of_family = np.full(len(family_guests), -1)
+    family_of_host = np.full(len(host_profiles), -1)
+    # The assigned hosts of every profile, sorted by position, for the swaps
+    assigned_hosts = [[] for _ in range(profiles_number)]
+
+    def assign(family, free_host) -> None:
+        position, profile, i = free_host
+        free_hosts.take(profile, i)
+        insort(assigned_hosts[profile], position)
+        host_of_family[family] = position
+        family_of_host[position] = family
+
+    order = np.lexsort((families["need row"], candidates_count))
+    order = order[candidates_count[order] > 0]
+    for family in order.tolist():
+        free_host = free_hosts.find(
+            compatible_profiles[family_profiles[family]], family_guests[family]
+        )
+        if free_host is not None:
+            assign(family, free_host)
+
+    for family in order[host_of_family[order] == -1].tolist():
+        if not any(free_hosts.positions):
+            break
+        # Hosts that the family can get, from the smallest, that are assigned to another family.
+        # The hosts are sorted by capacity, so the ones with enough beds start at first_position
+        first_position = np.searchsorted(hosts["number of guests"], family_guests[family])
+        swap_candidates = []
+        for profile in compatible_profiles[family_profiles[family]]:
+            i = bisect_left(assigned_hosts[profile], first_position)
+            swap_candidates += assigned_hosts[profile][i : i + max_swap_candidates]
+        for position in sorted(swap_candidates)[:max_swap_candidates]:
+            other_family = family_of_host[position]
+            free_host = free_hosts.find(
+                compatible_profiles[family_profiles[other_family]],
+                family_guests[other_family],
+            )
+            if free_host is not None:
+                assign(other_family, free_host)
+                host_of_family[family] = position
+                family_of_host[position] = family
+                break
+
+    assigned = np.flatnonzero(host_of_family >= 0)
+    host_positions = host_of_family[assigned]
+    assignments = pd.DataFrame(
+        {
+            "need row": families["need row"][assigned],
+            "full name": families["full name"][assigned],
+            "number of guests": family_guests[assigned],
+            "give row": hosts["give row"][host_positions],
+            "host number of guests": hosts["number of guests"][host_positions],
+        }
+    )
+    assignments["spare beds"] = (
+        assignments["host number of guests"] - assignments["number of guests"]
+    )
+
+    unassigned = np.flatnonzero(host_of_family < 0)
+    no_number_of_guests = family_guests[unassigned] == np.iinfo(np.int32).max
+    unmatched = pd.DataFrame(
+        {
+            "need row": families["need row"][unassigned],
+            "full name": families["full name"][unassigned],
+            "number of guests": pd.array(
+                np.where(no_number_of_guests, 0, family_guests[unassigned]),
+                dtype="Int32",
+            ),
+            "candidates": candidates_count[unassigned],
+            "reason": np.select(
+                [no_number_of_guests, candidates_count[unassigned] == 0],
+                ["no number of guests", "no host fits the criteria"],
+                "the fitting hosts are assigned to other families",
+            ),
+        }
+    )
+    unmatched.loc[no_number_of_guests, "number of guests"] = pd.NA
+    return assignments, unmatched
+
+
+def give_value(host, column) -> str:
+    """
+    This function return the value of a give house row by its column position, as a string without nan
+    :param host:
+    :param column:
+    :return:
+    """
+    if column >= len(host) or pd.isna(host.iloc[column]):
+        return ""
+    return str(host.iloc[column])
+
+
+class HostsIndex:
+    """
+    In-memory inverted index over the give houses, for looking up the hosts of one family
+    without running the whole pipeline.
+    Every host has a profile, the bits of the status, kosher, pets and mamad filters that it passes,
+    and the number of guests is a sorted array of capacities, each with its hosts sorted by kosher
+    and row, so the NUMBER_GREATER_THAN_EQ criterion is a binary search and the other filters
+    are one AND of the small profile per host
+    """
+
+    profile_bits = {
+        "available": 1,
+        "kosher": 2,
+        "not kosher": 4,
+        "pets": 8,
+        "mamad": 16,
+    }
+    filter_columns = {
+        "kosher": give_kosher_column,
+        "not kosher": give_not_kosher_column,
+        "pets": give_pets_column,
+        "mamad": give_mamad_column,
+    }
+
+    def __init__(self):
+        self.hosts = {}  # give row -> (capacity, kosher, profile) of the host
+        self.capacities = []
+        self.capacity_hosts = {}  # capacity -> sorted list of (kosher, give row, profile)
+
+    @classmethod
+    def from_give_df(cls, give_house_df, header_row_number=2):
+        """
+        Build the index from the give houses as returned by get_df, whose index 0 is the header row
+        """
+        index = cls()
+        for i, host in give_house_df.iterrows():
+            index.add(i + header_row_number, host)
+        return index
+
+    def add(self, give_row, host) -> None:
+        """
+        Add a give house row to the index
+        :param give_row: the row number of the host in the give houses spreadsheet
+        :param host: the row of the give houses dataframe
+        """
+        if give_row in self.hosts:
+            self.remove(give_row)
+
+        capacity = pd.to_numeric(give_value(host, give_guests_column), errors="coerce")
+        kosher = give_value(host, give_kosher_column)
+        profile = 0
+        if give_value(host, give_status_column) not in give_hidden_statuses:
+            profile |= self.profile_bits["available"]
+        for column, position in self.filter_columns.items():
+            value = give_value(host, position)
+            passes = value == "לא" if column == "not kosher" else "לא" not in value
+            if passes:
+                profile |= self.profile_bits[column]
+        self.hosts[give_row] = (capacity, kosher, profile)
+        if pd.notna(capacity):
+            if capacity not in self.capacity_hosts:
+                insort(self.capacities, capacity)
+                self.capacity_hosts[capacity] = []
+            insort(self.capacity_hosts[capacity], (kosher, give_row, profile))
+
+    def update(self, give_row, host) -> None:
+        """
+        Replace the give house row in the index
+        """
+        self.add(give_row, host)
+
+    def remove(self, give_row) -> None:
+        """
+        Remove the give house row from the index
+        """
+        capacity, kosher, profile = self.hosts.pop(give_row)
+        if pd.notna(capacity):
+            hosts = self.capacity_hosts[capacity]
+            del hosts[bisect_left(hosts, (kosher, give_row, profile))]
+            if not hosts:
+                del self.capacity_hosts[capacity]
+                self.capacities.remove(capacity)
+
+    def query(self, need_row) -> list:
+        """
+        Return the give rows of the hosts that the family can see in its filter view,
+        sorted like the filter view sortSpecs (number of guests and then kosher)
+        :param need_row: a row of the need houses after clean_need_df
+        """
+        number_of_guests = pd.to_numeric(need_row["number of guests"], errors="coerce")
+        if pd.isna(number_of_guests):
+            return []
+        required = self.profile_bits["available"]
+        for column in ["kosher", "pets", "mamad"]:
+            if need_row[column] not in ("לא", ""):
+                required |= self.profile_bits[column]
+        if need_row["kosher"] == "לא":
+            required |= self.profile_bits["not kosher"]
+
+        candidates = []
+        for capacity in self.capacities[bisect_left(self.capacities, number_of_guests) :]:
+            candidates += [
+                give_row
+                for _, give_row, profile in self.capacity_hosts[capacity]
+                if profile & required == required
+            ]
+        return candidates
+
+
+def write_matches(matches, path) -> None:
+    """
+    This function write the matches to a CSV file, or to a JSON file when the path ends with .json
+    :param matches:
+    :param path:
+    :return:
+    """
+    if path.endswith(".json"):
+        matches.to_json(path, orient="records", force_ascii=False, indent=1)
+    else:
+        matches.to_csv(path, index=False, encoding="utf-8-sig")
+
+
+def create_matches_file(
+    need_spreadsheet_id,
+    give_spreadsheet_id,
+    path,
+    max_candidates=None,
+    give_gsheet_id=0,
+    give_header_row_number=2,
+) -> None:
+    """
+    This function load both spreadsheets, match the families to the hosts and write the matches file
+    :param need_spreadsheet_id:
+    :param give_spreadsheet_id:
+    :param path:
+    :param max_candidates:
+    :param give_gsheet_id: the id of the give houses tab
+    :param give_header_row_number: the row of the headers in the give houses tab
+    :return:
+    """
+    need_house_df = get_df_from_google_sheet(
+        "need_df", need_spreadsheet_id=need_spreadsheet_id, only_used_columns=True
+    )
+    need_house_df = clean_need_df(need_house_df)
+    give_house_df = get_df_from_google_sheet(
+        "give_df",
+        give_spreadsheet_id=give_spreadsheet_id,
+        give_gsheet_id=give_gsheet_id,
+        give_header_row_number=give_header_row_number,
+    )
+    matches = match_families_to_hosts(
+        need_house_df, give_house_df, max_candidates, give_header_row_number
+    )
+    write_matches(matches, path)
+    print(f"{matches['need row'].nunique()} families have candidates, see {path}")
+
+
+def create_assignment_files(
+    need_spreadsheet_id,
+    give_spreadsheet_id,
+    assignments_path,
+    unmatched_path,
+    give_gsheet_id=0,
+    give_header_row_number=2,
+) -> None:
+    """
+    This function load both spreadsheets, assign the families to the hosts and write
+    the proposed assignments and the unmatched families
+    :param need_spreadsheet_id:
+    :param give_spreadsheet_id:
+    :param assignments_path:
+    :param unmatched_path:
+    :param give_gsheet_id: the id of the give houses tab
+    :param give_header_row_number: the row of the headers in the give houses tab
+    :return:
+    """
+    need_house_df = get_df_from_google_sheet(
+        "need_df", need_spreadsheet_id=need_spreadsheet_id, only_used_columns=True
+    )
+    need_house_df = clean_need_df(need_house_df)
+    give_house_df = get_df_from_google_sheet(
+        "give_df",
+        give_spreadsheet_id=give_spreadsheet_id,
+        give_gsheet_id=give_gsheet_id,
+        give_header_row_number=give_header_row_number,
+    )
+    assignments, unmatched = assign_families_to_hosts(
+        need_house_df, give_house_df, header_row_number=give_header_row_number
+    )
+    write_matches(assignments, assignments_path)
+    write_matches(unmatched, unmatched_path)
+    print(
+        f"{len(assignments)} families assigned, see {assignments_path}; "
+        f"{len(unmatched)} unmatched, see {unmatched_path}"
+    )
+
+
+def main(assign=False):
+    give_spreadsheet_id = ""
+    give_gsheet_id = 0
+    # the row of the headers in the give houses tab
+    give_header_row_number = 2
+    need_spreadsheet_id = ""
+    # number of candidates to write for each family, None writes all of them
+    max_candidates = 20
+
+    if assign:
+        create_assignment_files(
+            need_spreadsheet_id,
+            give_spreadsheet_id,
+            "assignments.csv",
+            "unmatched.csv",
+            give_gsheet_id,
+            give_header_row_number,
+        )
+    else:
+        create_matches_file(
+            need_spreadsheet_id,
+            give_spreadsheet_id,
+            "matches.csv",
+            max_candidates,
+            give_gsheet_id,
+            give_header_row_number,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--assign",
+        action="store_true",
+        help="propose one host for every family instead of listing all the candidates",
+    )
+    args = parser.parse_args()
+    main(assign=args.assign)
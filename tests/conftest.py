@@ -0,0 +1,64 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from fake_sheets import FakeSheetsService, generate_give_values, generate_need_values
+
+need_spreadsheet_id = "need"
+give_spreadsheet_id = "give"
+give_tab = "give"
+
+
+@pytest.fixture
+def service(monkeypatch, tmp_path):
+    """
+    The fake Sheets service with a synthetic need sheet, installed as the service of main,
+    with a clean run state and no pacing
+    """
+    monkeypatch.chdir(tmp_path)
+    service = FakeSheetsService(
+        {
+            need_spreadsheet_id: {main.need_sheet_range: generate_need_values(200)},
+            give_spreadsheet_id: {give_tab: generate_give_values(20)},
+        }
+    )
+    monkeypatch.setattr(main, "sheets_service", service)
+    monkeypatch.setattr(main, "rate_limiter", main.RateLimiter(60 * 10**6, burst=10**6))
+    monkeypatch.setattr(main, "run_metrics", main.RunMetrics())
+    monkeypatch.setattr(main, "people_that_have_filter", [])
+    monkeypatch.setattr(main, "created_filter_views", {})
+    monkeypatch.setattr(main, "filter_views_index", {})
+    monkeypatch.setattr(main, "checkpoint_journal", None)
+    monkeypatch.setattr(main, "snapshot_store", None)
+    return service
+
+
+@pytest.fixture
+def need_house_df(service):
+    """
+    The cleaned need houses of the fake need sheet
+    """
+    return main.clean_need_df(main.get_df(need_spreadsheet_id))
+
+
+def make_need_house_df(rows) -> pd.DataFrame:
+    """
+    Cleaned need houses from (full name, number of guests, kosher, pets, mamad) tuples
+    """
+    return pd.DataFrame(
+        {
+            "full name": [row[0] for row in rows],
+            "number of guests": [row[1] for row in rows],
+            "kosher": [row[2] for row in rows],
+            "pets": [row[3] for row in rows],
+            "mamad": [row[4] for row in rows],
+            "treatment": "",
+            "request status": None,
+        },
+        index=range(1, len(rows) + 1),
+    )
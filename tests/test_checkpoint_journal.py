@@ -0,0 +1,55 @@
+import main
+from conftest import give_spreadsheet_id
+
+
+def get_guests_criterion(service, title):
+    criteria = service.filter_views[give_spreadsheet_id][title]["criteria"]
+    return criteria[main.number_of_guests_column]["condition"]["values"]["userEnteredValue"]
+
+
+def test_a_changed_row_is_sent_again_with_a_journal_open(service, need_house_df, monkeypatch):
+    monkeypatch.setattr(main, "checkpoint_journal", main.CheckpointJournal("journal.jsonl"))
+    my_range = main.get_my_range(0)
+    state = main.open_state_store(":memory:")
+    main.give_filters(need_house_df, my_range, service, give_spreadsheet_id, 50, state)
+
+    changed = need_house_df.copy()
+    i = changed.index[0]
+    changed.loc[i, "number of guests"] = "11"
+    main.give_filters(
+        changed,
+        my_range,
+        service,
+        give_spreadsheet_id,
+        50,
+        state,
+        main.get_existing_filter_views(give_spreadsheet_id, service),
+    )
+
+    title = str(i + 2) + "_" + changed.loc[i, "full name"]
+    assert get_guests_criterion(service, title) == "11"
+    synced_row = main.get_synced_row(state, give_spreadsheet_id, str(i + 2))
+    row = changed.loc[i]
+    assert synced_row[0] == main.need_row_hash(
+        row["full name"], "11", row["kosher"], row["pets"], row["mamad"]
+    )
+
+
+def test_a_resumed_run_skips_only_the_requests_of_the_previous_run(service, need_house_df):
+    my_range = main.get_my_range(0)
+    main.checkpoint_journal = main.CheckpointJournal("journal.jsonl")
+    main.give_filters(need_house_df, my_range, service, give_spreadsheet_id, 50)
+    main.checkpoint_journal.close()
+    calls = service.calls["batchUpdate"]
+    service.filter_views[give_spreadsheet_id] = {}
+
+    main.checkpoint_journal = main.CheckpointJournal("journal.jsonl", resume=True)
+    changed = need_house_df.copy()
+    i = changed.index[0]
+    changed.loc[i, "number of guests"] = "11"
+    main.give_filters(changed, my_range, service, give_spreadsheet_id, 50)
+    main.checkpoint_journal.close()
+
+    title = str(i + 2) + "_" + changed.loc[i, "full name"]
+    assert list(service.filter_views[give_spreadsheet_id]) == [title]
+    assert service.calls["batchUpdate"] == calls + 1
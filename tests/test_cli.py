@@ -0,0 +1,27 @@
+import pandas as pd
+
+import cli
+import main
+from conftest import need_spreadsheet_id
+
+
+def run_clean(*arguments) -> pd.DataFrame:
+    args = cli.get_parser().parse_args(
+        ["--need-spreadsheet-id", need_spreadsheet_id, *arguments, "clean", "--output", "clean.csv"]
+    )
+    args.function(args)
+    return pd.read_csv("clean.csv", encoding="utf-8-sig", index_col=0)
+
+
+def test_dedup_none_keeps_the_repeated_submissions(service, need_house_df):
+    values = service.sheets[need_spreadsheet_id][main.need_sheet_range]
+    values.append(list(values[2]))
+
+    assert len(run_clean("--dedup", "none")) == len(need_house_df) + 1
+    assert len(run_clean("--dedup", "collapse")) == len(need_house_df)
+
+
+def test_snapshot_ttl_is_passed_to_the_snapshot_store(service):
+    run_clean("--snapshot-ttl", "60")
+
+    assert main.snapshot_store.ttl == 60
@@ -0,0 +1,72 @@
+import pandas as pd
+
+import main
+from conftest import need_spreadsheet_id
+from fake_sheets import generate_need_values
+
+
+def make_families(rows, index) -> pd.DataFrame:
+    """
+    Need houses from (full name, phone number) tuples
+    """
+    return pd.DataFrame(
+        {
+            "full name": [row[0] for row in rows],
+            "phone number": [row[1] for row in rows],
+        },
+        index=index,
+    )
+
+
+def test_collapse_keeps_the_first_submission_of_a_family():
+    need_house_df = make_families(
+        [
+            ("משה כהן", "050-1234567"),
+            ("דנה לוי", ""),
+            ("כהן משה", "+972501234567"),
+            ("משפחת לוי דנה", ""),
+            ("משה כהן", "0529999999"),
+        ],
+        range(1, 6),
+    )
+
+    collapsed = main.dedup_need_df(need_house_df, "collapse")
+    flagged = main.dedup_need_df(need_house_df, "flag")
+
+    assert collapsed.index.tolist() == [1, 2, 5]
+    assert flagged["duplicate of"].tolist() == [pd.NA, pd.NA, 3, 4, pd.NA]
+
+
+def test_a_block_is_compared_with_the_earlier_blocks():
+    duplicate_finder = main.DuplicateFinder()
+    first_block = make_families([("משה כהן", "0501234567"), ("דנה לוי", "")], [1, 2])
+    second_block = make_families([("דנה לוי", "0541111111"), ("רון שגיא", "")], [3, 4])
+
+    main.dedup_need_df(first_block, "collapse", duplicate_finder)
+    collapsed = main.dedup_need_df(second_block, "collapse", duplicate_finder)
+
+    assert collapsed.index.tolist() == [4]
+
+
+def test_a_row_read_twice_is_not_its_own_duplicate():
+    duplicate_finder = main.DuplicateFinder()
+    need_house_df = make_families([("משה כהן", "0501234567")], [1])
+
+    main.dedup_need_df(need_house_df, "collapse", duplicate_finder)
+    flagged = main.dedup_need_df(need_house_df, "flag", duplicate_finder)
+
+    assert flagged["duplicate of"].isna().all()
+
+
+def test_the_need_blocks_are_deduplicated(service):
+    values = generate_need_values(200)
+    # The family of sheet row 13 (row 11 of the dataframe) submits again on sheet row 161, both active
+    family = values[12][:20] + [""] * (21 - len(values[12][:20]))
+    values[12], values[160] = family, list(family)
+    service.sheets[need_spreadsheet_id][main.need_sheet_range] = values
+
+    blocks = list(main.get_need_df_blocks(need_spreadsheet_id, 50, "collapse"))
+    rows = [row for block in blocks for row in block.index]
+
+    assert 11 in rows
+    assert 159 not in rows
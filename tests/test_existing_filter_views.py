@@ -0,0 +1,48 @@
+import main
+from conftest import give_spreadsheet_id
+from fake_sheets import FakeRequest, make_http_error
+
+
+def fail_spreadsheet_reads(service, monkeypatch) -> None:
+    """
+    Make every spreadsheets().get of the fake service fail with a 500
+    """
+
+    def get(spreadsheetId, fields=None, **kwargs):
+        def fail():
+            raise make_http_error(500, "server error")
+
+        return FakeRequest(service, "get", fail)
+
+    monkeypatch.setattr(service, "get", get)
+
+
+def test_a_failed_read_is_not_cached_as_an_empty_spreadsheet(service, monkeypatch):
+    with monkeypatch.context() as context:
+        fail_spreadsheet_reads(service, context)
+        assert main.get_existing_filter_views(give_spreadsheet_id, service) is None
+    assert main.get_existing_filter_views(give_spreadsheet_id, service) == {}
+    assert give_spreadsheet_id in main.filter_views_index
+
+
+def test_synced_rows_are_not_sent_again_when_the_views_cannot_be_read(
+    service, need_house_df, monkeypatch
+):
+    my_range = main.get_my_range(0)
+    state = main.open_state_store(":memory:")
+    main.give_filters(need_house_df, my_range, service, give_spreadsheet_id, 50, state)
+    calls = service.calls["batchUpdate"]
+    fail_spreadsheet_reads(service, monkeypatch)
+
+    rows_with_errors = main.give_filters(
+        need_house_df,
+        my_range,
+        service,
+        give_spreadsheet_id,
+        50,
+        state,
+        main.get_existing_filter_views(give_spreadsheet_id, service),
+    )
+
+    assert rows_with_errors == []
+    assert service.calls["batchUpdate"] == calls
@@ -0,0 +1,34 @@
+import json
+
+import main
+from conftest import make_need_house_df
+
+my_range = main.get_my_range(0)
+
+
+def test_create_filter_view_requests_equals_create_filter_view_request():
+    need_house_df = make_need_house_df(
+        [
+            ("משפחה א", "4-5", "כן", "לא", ""),
+            ("משפחה ב", "3 נפשות", "לא", "כן", "כן"),
+            ("משפחה ג", "2.5", "", "", "לא"),
+            ("משפחה ד", "05", "nan", "nan", "nan"),
+            ("משפחה ה", "2", "כשר למהדרין", "", "כן"),
+            ("משפחה ו", "", "לא", "לא", "לא"),
+        ]
+    )
+    expected = [
+        main.create_filter_view_request(
+            my_range, full_name, str(i + 2), number_of_guests, kosher, pets, mamad
+        )
+        for i, (full_name, number_of_guests, kosher, pets, mamad) in zip(
+            need_house_df.index,
+            need_house_df[
+                ["full name", "number of guests", "kosher", "pets", "mamad"]
+            ].itertuples(index=False),
+        )
+    ]
+    bodies = main.create_filter_view_requests(need_house_df, my_range)
+    assert json.dumps(bodies, ensure_ascii=False) == json.dumps(
+        expected, ensure_ascii=False
+    )
@@ -0,0 +1,15 @@
+import main
+
+
+def test_the_give_df_is_read_from_the_tab_of_its_gsheet_id(service):
+    service.sheets["hosts"] = {
+        "summary": [["total", "2"]],
+        "hosts": [["name", "guests"], ["מארח 1", "4"], ["מארח 2", "6"]],
+    }
+
+    give_house_df = main.get_df_from_google_sheet(
+        "give_df", give_spreadsheet_id="hosts", give_gsheet_id=1, give_header_row_number=1
+    )
+
+    assert list(give_house_df.columns) == ["name", "guests"]
+    assert give_house_df["guests"].tolist()[-2:] == ["4", "6"]
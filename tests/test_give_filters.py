@@ -0,0 +1,54 @@
+import json
+
+import main
+from conftest import give_spreadsheet_id
+
+
+def test_give_filters_sends_the_requests_of_create_filter_view_request(
+    service, need_house_df
+):
+    my_range = main.get_my_range(0)
+    main.give_filters(need_house_df, my_range, service, give_spreadsheet_id, 50)
+
+    expected = {}
+    for i, row in need_house_df.iterrows():
+        body = main.create_filter_view_request(
+            my_range,
+            row["full name"],
+            str(i + 2),
+            row["number of guests"],
+            row["kosher"],
+            row["pets"],
+            row["mamad"],
+        )
+        filter_view = body["requests"][0]["addFilterView"]["filter"]
+        expected[filter_view["title"]] = filter_view
+    created = {
+        title: {key: value for key, value in filter_view.items() if key != "filterViewId"}
+        for title, filter_view in service.filter_views[give_spreadsheet_id].items()
+    }
+    assert json.dumps(created, ensure_ascii=False, sort_keys=True) == json.dumps(
+        expected, ensure_ascii=False, sort_keys=True
+    )
+
+
+def test_a_synced_row_whose_view_was_deleted_is_sent_again(service, need_house_df):
+    my_range = main.get_my_range(0)
+    state = main.open_state_store(":memory:")
+    main.give_filters(need_house_df, my_range, service, give_spreadsheet_id, 50, state)
+    deleted_title = next(iter(service.filter_views[give_spreadsheet_id]))
+    del service.filter_views[give_spreadsheet_id][deleted_title]
+
+    rows_with_errors = main.give_filters(
+        need_house_df,
+        my_range,
+        service,
+        give_spreadsheet_id,
+        50,
+        state,
+        main.get_existing_filter_views(give_spreadsheet_id, service),
+    )
+
+    assert rows_with_errors == []
+    assert deleted_title in service.filter_views[give_spreadsheet_id]
+    assert len(service.filter_views[give_spreadsheet_id]) == len(need_house_df)
@@ -0,0 +1,47 @@
+import pandas as pd
+
+import main
+import matching
+from fake_sheets import generate_give_values, generate_need_values
+
+
+def get_df(values) -> pd.DataFrame:
+    return pd.DataFrame.from_records(values[1:], columns=values[1])
+
+
+def test_an_updated_index_answers_like_a_new_one():
+    give_house_df = get_df(generate_give_values(300))
+    need_house_df = main.clean_need_df(get_df(generate_need_values(100)))
+    index = matching.HostsIndex.from_give_df(give_house_df)
+    # The host of dataframe row i is give row i + 2
+    removed = range(1, 301, 3)
+    updated = range(2, 301, 3)
+    changed_hosts = get_df(generate_give_values(300, seed=1))
+    for i in removed:
+        index.remove(i + 2)
+    for i in updated:
+        index.update(i + 2, changed_hosts.loc[i])
+
+    expected_give_house_df = give_house_df.copy()
+    expected_give_house_df.loc[updated] = changed_hosts.loc[updated]
+    expected_give_house_df = expected_give_house_df.drop(index=removed)
+    expected_index = matching.HostsIndex.from_give_df(expected_give_house_df)
+
+    for _, need_row in need_house_df.iterrows():
+        assert index.query(need_row) == expected_index.query(need_row)
+
+
+def test_the_give_rows_follow_the_header_row_of_the_tab(service):
+    # Without the title row the headers are on row 1, and the host "מארח 0" on row 2
+    service.sheets["hosts"] = {"hosts": generate_give_values(20)[1:]}
+    give_house_df = main.get_df_from_google_sheet(
+        "give_df", give_spreadsheet_id="hosts", give_header_row_number=1
+    )
+    first_host_row = 2
+
+    typed_give_df = matching.get_typed_give_df(give_house_df, header_row_number=1)
+    assert typed_give_df.loc[typed_give_df["give row"] == first_host_row].index.tolist() == [1]
+    assert give_house_df.loc[1].iloc[1] == "מארח 0"
+    index = matching.HostsIndex.from_give_df(give_house_df, header_row_number=1)
+    assert first_host_row in index.hosts
+    assert 21 in index.hosts and 22 not in index.hosts
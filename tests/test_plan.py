@@ -0,0 +1,49 @@
+import json
+
+import main
+from conftest import give_spreadsheet_id, need_spreadsheet_id
+
+
+def get_created_filter_views(service, spreadsheet_id) -> list:
+    """
+    The filter views of the fake service in the order they were added, without their ids
+    """
+    return [
+        {key: value for key, value in filter_view.items() if key != "filterViewId"}
+        for filter_view in service.filter_views[spreadsheet_id].values()
+    ]
+
+
+def test_create_plan_gives_the_requests_of_give_filters(service, need_house_df):
+    plan = main.create_plan(
+        need_house_df, give_spreadsheet_id, 0, need_spreadsheet_id, 0
+    )
+    main.give_filters(
+        need_house_df, main.get_my_range(0), service, give_spreadsheet_id, 50
+    )
+
+    planned = [
+        operation["request"]["addFilterView"]["filter"]
+        for operation in plan
+        if operation["pass"] == "give"
+    ]
+    assert json.dumps(planned, ensure_ascii=False) == json.dumps(
+        get_created_filter_views(service, give_spreadsheet_id), ensure_ascii=False
+    )
+
+
+def test_apply_plan_creates_the_views_of_the_live_run(service, need_house_df):
+    main.give_filters(
+        need_house_df, main.get_my_range(0), service, give_spreadsheet_id, 50
+    )
+    live_filter_views = get_created_filter_views(service, give_spreadsheet_id)
+    service.filter_views[give_spreadsheet_id] = {}
+
+    plan = main.create_plan(
+        need_house_df, give_spreadsheet_id, 0, need_spreadsheet_id, 0
+    )
+    main.apply_plan([operation for operation in plan if operation["pass"] == "give"], 50)
+
+    assert json.dumps(
+        get_created_filter_views(service, give_spreadsheet_id), ensure_ascii=False
+    ) == json.dumps(live_filter_views, ensure_ascii=False)
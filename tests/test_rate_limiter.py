@@ -0,0 +1,39 @@
+import main
+from fake_sheets import make_http_error
+
+
+class FailingRequest:
+    """
+    A request that fails with the given statuses before it succeeds
+    """
+
+    method = "batchUpdate"
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+
+    def execute(self):
+        if self.statuses:
+            raise make_http_error(self.statuses.pop(0), "error")
+        return {}
+
+
+def test_a_slow_answer_does_not_lower_the_rate():
+    rate_limiter = main.AdaptiveRateLimiter(60)
+    rate_limiter.on_response(30.0)
+    assert rate_limiter.rate > 1
+
+
+def test_429_and_503_lower_the_rate(monkeypatch):
+    rate_limiter = main.AdaptiveRateLimiter(60 * 10**6, burst=10**6, max_requests_per_minute=60 * 10**6)
+    monkeypatch.setattr(main, "rate_limiter", rate_limiter)
+    monkeypatch.setattr(main, "run_metrics", main.RunMetrics())
+    monkeypatch.setattr(main, "sleep", lambda seconds: None)
+
+    main.execute_with_retries(FailingRequest([503]))
+    assert rate_limiter.rate < 10**6
+
+    rate = rate_limiter.rate
+    rate_limiter.decreased = float("-inf")
+    main.execute_with_retries(FailingRequest([429]))
+    assert rate_limiter.rate < rate
@@ -0,0 +1,54 @@
+import main
+from conftest import give_spreadsheet_id
+
+
+def create_give_filters(service, need_house_df) -> str:
+    """
+    Create the filter views of the need houses and return their range
+    """
+    my_range = main.get_my_range(0)
+    main.give_filters(need_house_df, my_range, service, give_spreadsheet_id, 50)
+    return my_range
+
+
+def test_reconcile_right_after_create_is_a_no_op(service, need_house_df):
+    my_range = create_give_filters(service, need_house_df)
+    filter_views = dict(service.filter_views[give_spreadsheet_id])
+
+    result = main.reconcile_filters(
+        need_house_df, my_range, service, give_spreadsheet_id, 50
+    )
+
+    assert result == {"deleted": 0, "updated": 0, "errors": 0}
+    assert service.filter_views[give_spreadsheet_id] == filter_views
+
+
+def test_an_inactive_family_view_is_deleted(service, need_house_df):
+    my_range = create_give_filters(service, need_house_df)
+    inactive_title = str(need_house_df.index[0] + 2) + "_" + need_house_df["full name"].iloc[0]
+    assert inactive_title in service.filter_views[give_spreadsheet_id]
+
+    result = main.reconcile_filters(
+        need_house_df.iloc[1:], my_range, service, give_spreadsheet_id, 50
+    )
+
+    assert result == {"deleted": 1, "updated": 0, "errors": 0}
+    assert inactive_title not in service.filter_views[give_spreadsheet_id]
+    assert len(service.filter_views[give_spreadsheet_id]) == len(need_house_df) - 1
+
+
+def test_a_view_whose_sort_specs_drifted_is_updated(service, need_house_df):
+    my_range = create_give_filters(service, need_house_df)
+    title = next(iter(service.filter_views[give_spreadsheet_id]))
+    service.filter_views[give_spreadsheet_id][title]["sortSpecs"] = [
+        {"dimensionIndex": main.number_of_guests_column, "sortOrder": "DESCENDING"}
+    ]
+
+    result = main.reconcile_filters(
+        need_house_df, my_range, service, give_spreadsheet_id, 50
+    )
+
+    assert result == {"deleted": 0, "updated": 1, "errors": 0}
+    assert (
+        service.filter_views[give_spreadsheet_id][title]["sortSpecs"] == main.give_sort_specs
+    )
@@ -0,0 +1,10 @@
+import os
+
+import main
+
+
+def test_the_shard_name_prefixes_the_file_name():
+    assert main.get_shard_path("north", "journal.jsonl") == "north_journal.jsonl"
+    assert main.get_shard_path("north", os.path.join("runs", "state.sqlite")) == os.path.join(
+        "runs", "north_state.sqlite"
+    )
@@ -0,0 +1,21 @@
+import main
+from conftest import give_spreadsheet_id, need_spreadsheet_id
+
+
+def test_only_existing_family_views_are_listed_in_people_that_have_filter(service):
+    need_range = main.get_my_range(0)
+    give_body = main.create_filter_view_request(
+        main.get_my_range(0), "משה כהן", "5", "3", "כן", "לא", ""
+    )
+    treatment_body = main.create_filter_view_request_treatment(need_range, "דנה")
+    type_body = main.create_filter_view_request_type(need_range, "בטיפול")
+    for spreadsheet_id, body in [
+        (give_spreadsheet_id, give_body),
+        (need_spreadsheet_id, treatment_body),
+        (need_spreadsheet_id, type_body),
+    ]:
+        assert not main.update_spreadsheet(spreadsheet_id, body, service)
+        # A second view with the same title fails with the "שם אחר" error
+        assert not main.update_spreadsheet(spreadsheet_id, body, service)
+
+    assert main.people_that_have_filter == ["5_משה כהן"]
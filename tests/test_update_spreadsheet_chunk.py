@@ -0,0 +1,29 @@
+import main
+from conftest import give_spreadsheet_id
+
+
+def test_a_chunk_that_runs_out_of_quota_is_not_split(service, need_house_df, monkeypatch):
+    monkeypatch.setattr(main, "sleep", lambda seconds: None)
+    service.quota_error_rate = 1
+    bodies = main.create_filter_view_requests(need_house_df.iloc[:100], main.get_my_range(0))
+    rows = [[str(i)] for i in range(100)]
+
+    rows_with_errors = main.update_spreadsheet_chunk(
+        give_spreadsheet_id, bodies, rows, service
+    )
+
+    assert rows_with_errors == rows
+    assert service.calls["batchUpdate"] == main.max_retries + 1
+
+
+def test_a_chunk_with_a_bad_request_is_split_to_find_it(service, need_house_df):
+    bodies = main.create_filter_view_requests(need_house_df.iloc[:8], main.get_my_range(0))
+    bodies[5] = bodies[2]
+    rows = [[str(i)] for i in range(8)]
+
+    rows_with_errors = main.update_spreadsheet_chunk(
+        give_spreadsheet_id, bodies, rows, service
+    )
+
+    assert rows_with_errors == []
+    assert len(service.filter_views[give_spreadsheet_id]) == 7
@@ -0,0 +1,45 @@
+import socket
+
+import httplib2
+import pytest
+
+import main
+from conftest import give_spreadsheet_id, need_spreadsheet_id
+from fake_sheets import make_http_error
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        make_http_error(500, "server error"),
+        socket.timeout("timed out"),
+        ConnectionResetError("connection reset"),
+        httplib2.ServerNotFoundError("server not found"),
+    ],
+)
+def test_a_failed_poll_backs_off_and_the_watch_goes_on(service, monkeypatch, error):
+    get_sheet_timestamps = main.get_sheet_timestamps
+    polls = []
+
+    def get_failing_sheet_timestamps(spreadsheet_id):
+        polls.append(spreadsheet_id)
+        if len(polls) == 2:
+            raise error
+        return get_sheet_timestamps(spreadsheet_id)
+
+    intervals = []
+    monkeypatch.setattr(main, "get_sheet_timestamps", get_failing_sheet_timestamps)
+    monkeypatch.setattr(main, "sleep", intervals.append)
+
+    main.watch_filters(
+        give_spreadsheet_id,
+        0,
+        need_spreadsheet_id,
+        0,
+        batch_size=50,
+        poll_interval=10,
+        max_polls=3,
+    )
+
+    assert len(polls) == 4
+    assert intervals == [10, 20, 10]